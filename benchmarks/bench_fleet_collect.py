@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Collect the change feeds of a simulated fleet into one store, full then incremental"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import maintenance_collector
+import yumi_maintenance
+
+TASKS = ('oil_xy_axes', 'oil_z_axes', 'clean_nozzle', 'clean_plate', 'belt_tension', 'clean_fan')
+ACTIONS = ('shown', 'postponed', 'confirmed')
+
+
+def history_rows(now):
+    return [(name, None, (now + timedelta(days=random.randint(1, 90))).isoformat(), 0, '{}') for name in TASKS]
+
+
+def event_rows(count, now):
+    return [yumi_maintenance.event_row(random.choice(TASKS), random.choice(ACTIONS),
+                                       {'print_seconds': random.uniform(0., 1e6)},
+                                       now - timedelta(minutes=random.randint(0, 500000)))
+            for _ in range(count)]
+
+
+def create_printer(path, events, now):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(yumi_maintenance.HISTORY_TABLE)
+    for sql in yumi_maintenance.SCHEMA:
+        conn.execute(sql)
+    conn.executemany(yumi_maintenance.HISTORY_UPSERT, history_rows(now))
+    conn.executemany(yumi_maintenance.EVENT_INSERT, event_rows(events, now))
+    conn.commit()
+    conn.close()
+
+
+def update_printer(path, now):
+    """One confirmed task and its prompt, as a day of use would add"""
+    conn = sqlite3.connect(path)
+    name = random.choice(TASKS)
+    conn.execute(yumi_maintenance.HISTORY_UPSERT, (name, now.isoformat(), (now + timedelta(days=30)).isoformat(),
+                                                   1, '{}'))
+    conn.executemany(yumi_maintenance.EVENT_INSERT, [yumi_maintenance.event_row(name, action, {}, now)
+                                                     for action in ('shown', 'confirmed')])
+    conn.commit()
+    conn.close()
+
+
+def collect(store, paths):
+    start = time.perf_counter()
+    changes = sum(maintenance_collector.collect(store, path)[1] for path in paths)
+    return time.perf_counter() - start, changes
+
+
+def report(label, elapsed, changes, printers):
+    print(f"{label:12s} {elapsed:7.2f}s  {changes:8d} changes  {elapsed / printers * 1e3:6.2f} ms/printer"
+          f"  {changes / elapsed if elapsed else 0.:9.0f} changes/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--printers', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=200, help="journal events per printer")
+    args = parser.parse_args()
+    random.seed(1)
+    now = datetime.now()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.printers):
+            os.makedirs(os.path.join(tmp, f"printer{i:04d}"))
+            paths.append(os.path.join(tmp, f"printer{i:04d}", "yumi_maintenance.db"))
+            create_printer(paths[-1], args.events, now)
+        store = maintenance_collector.open_store(os.path.join(tmp, "fleet.db"))
+        report("full", *collect(store, paths), args.printers)
+        report("unchanged", *collect(store, paths), args.printers)
+        for path in paths:
+            update_printer(path, now)
+        report("incremental", *collect(store, paths), args.printers)
+        rows = store.execute("SELECT (SELECT COUNT(*) FROM tasks), (SELECT COUNT(*) FROM events)").fetchone()
+        print(f"store: {rows[0]} tasks, {rows[1]} events, "
+              f"{os.path.getsize(os.path.join(tmp, 'fleet.db')) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Measure the cost of the maintenance odometer per second of printing"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+import yumi_maintenance
+
+PullMove = namedtuple('PullMove', yumi_maintenance.PULL_MOVE_FIELDS)
+
+
+def generate_moves(count, start=0.):
+    moves = []
+    print_time = start
+    for _ in range(count):
+        angle = random.uniform(0., 6.283)
+        move_t = random.uniform(.002, .05)
+        z_r = 1. if random.random() < .01 else 0.
+        moves.append(PullMove(print_time, move_t, random.uniform(0., 150.), random.uniform(-3000., 3000.),
+                              0., 0., 0., (1. - z_r) * math.cos(angle), (1. - z_r) * math.sin(angle), z_r))
+        print_time += move_t
+    return moves
+
+
+def bench(moves_per_second, sample_interval, rounds):
+    """Cost of counting one sample_interval worth of moves in a single batch"""
+    batch = generate_moves(int(moves_per_second * sample_interval))
+    _, buffers = fakes.FakeTrapQ(batch).extract_trapq(0., batch[-1].print_time)
+    result = {'moves_per_second': moves_per_second, 'sample_interval': sample_interval}
+    paths = [('loop', lambda: yumi_maintenance.move_distances(batch))]
+    if yumi_maintenance.numpy is not None:
+        paths.append(('numpy', lambda: yumi_maintenance.pull_move_distances(buffers, -1.)))
+    for name, run in paths:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            run()
+        result[f'{name}_us_per_sample'] = (time.perf_counter() - start) / rounds * 1e6
+    return result
+
+
+def bench_timer(moves_per_second, sample_interval, seconds=60., max_moves=500):
+    """Run MotionOdometer's timer over a simulated print, returns its per-sample costs"""
+    printer = fakes.FakePrinter()
+    moves = generate_moves(int(moves_per_second * seconds))
+    # Spread the generated moves over the simulated time
+    scale = seconds / moves[-1].print_time
+    moves = [m._replace(print_time=m.print_time * scale, move_t=m.move_t * scale) for m in moves]
+    printer.objects['motion_report'] = type('MotionReport', (), {})()
+    printer.objects['motion_report'].trapqs = {'toolhead': fakes.FakeTrapQ(moves)}
+    printer.objects['mcu'] = fakes.FakeMCU()
+    usage = type('Usage', (), {'add': lambda self, counter, value: None})()
+    odometer = yumi_maintenance.MotionOdometer(printer, usage, sample_interval, max_moves=max_moves)
+    odometer.handle_ready()
+    if yumi_maintenance.numpy is not None:
+        odometer.ffi = fakes.FakeFFI()
+    odometer.last_print_time = 0.
+    waketime = sample_interval
+    while waketime < seconds + 2 * sample_interval:
+        waketime = odometer._sample(waketime)
+    return odometer.get_overhead()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--interval', type=float, default=5.)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+    print(f"numpy: {'yes' if yumi_maintenance.numpy is not None else 'no'}")
+    for rate in (50, 200, 1000, 5000):
+        r = bench(rate, args.interval, args.rounds)
+        print(f"{rate:5d} moves/s, one {args.interval:g} s batch: "
+              + ", ".join(f"{k.split('_')[0]} {v:9.1f} us" for k, v in r.items() if k.endswith('_us_per_sample')))
+    for rate in (50, 200, 1000, 5000):
+        r = bench_timer(rate, args.interval)
+        print(f"{rate:5d} moves/s, timer: {r['samples']:4d} samples, "
+              f"avg {r['avg_sample_us']:8.1f} us, max {r['max_sample_us']:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
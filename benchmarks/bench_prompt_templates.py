@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Compare the cost per prompt of the old gcode script path with the precompiled templates"""
+import argparse
+import os
+import re
+import shlex
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import yumi_maintenance
+
+# Same line handling as klippy/gcode.py for extended commands such as RESPOND
+ARGS_R = re.compile('([A-Z_]+|[A-Z*])')
+EXTENDED_R = re.compile(r'^\s*(?:N[0-9]+\s*)?(?P<cmd>[a-zA-Z_][a-zA-Z0-9_]+)(?:\s+|$)'
+                        r'(?P<args>[^#*;]*?)\s*(?:[#*;].*)?$')
+
+
+def run_script(script, respond):
+    """What run_script_from_command plus RESPOND did for every prompt line"""
+    for line in script.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        parts = ARGS_R.split(line.upper())
+        if len(parts) < 2:
+            continue
+        m = EXTENDED_R.match(line)
+        params = dict(p.split('=', 1) for p in shlex.split(m.group('args')))
+        respond("// " + params['MSG'])
+
+
+def legacy_script(task):
+    """The f-string show_prompt used to build for every prompt"""
+    img_part = f'RESPOND TYPE=command MSG="action:prompt_image {task["imgqr"]}"\n' if 'imgqr' in task else ''
+    return f"""
+        RESPOND TYPE=command MSG="action:prompt_begin Maintenance Required"
+        RESPOND TYPE=command MSG="action:prompt_text {task['prompt']}"
+        {img_part}
+        RESPOND TYPE=command MSG="action:prompt_footer_button Not Now|MAINTENANCE_POSTPONE TASK={task['name']}"
+        RESPOND TYPE=command MSG="action:prompt_footer_button Confirm|MAINTENANCE_CONFIRM TASK={task['name']}"
+        RESPOND TYPE=command MSG="action:prompt_close_on_click"
+        RESPOND TYPE=command MSG="action:prompt_show"
+        """
+
+
+def bench(name, func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    us = (time.perf_counter() - start) / rounds * 1e6
+    print(f"{name:28s} {us:8.2f} us per prompt")
+    return us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+    task = yumi_maintenance.MaintenanceTask.from_options('clean_nozzle', {
+        'interval_days': '7', 'priority': '1', 'message': "Clean nozzle",
+        'prompt': "Code: E00 - MAINTENANCE: Clean nozzle (Weekly) Scan for complete guide",
+        'image': "/home/pi/KlipperScreen/styles/maintenance/nozzle.png"})
+    # The dict the old gcode script path was built from
+    legacy_task = {'name': task.name, 'prompt': task.prompt, 'imgqr': task.image}
+    sent = []
+    cached = {mode: yumi_maintenance.compile_prompt([task], mode) for mode in (True, False)}
+
+    def send(lines):
+        for line in lines:
+            sent.append(line)
+
+    old = bench("f-string + gcode parse", lambda: run_script(legacy_script(legacy_task), sent.append), args.rounds)
+    for mode, label in ((False, "cached per-line actions"), (True, "cached prompt_batch")):
+        new = bench(label, lambda: send(cached[mode]), args.rounds)
+        print(f"{'':28s} {old / new:8.1f}x faster")
+    compile_us = bench("compile once (config load)", lambda: yumi_maintenance.compile_prompt([task]), args.rounds)
+    print(f"compiling costs {compile_us / old:.2f} old prompts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Cold import time of the prompts.py widget, and what importing the QR stack eagerly used to add
+
+Every sample runs in a fresh interpreter. Without a GTK display the widget is
+imported against the headless stand-in from fakes.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPET = """
+import sys, time
+sys.path.insert(0, {here!r})
+import fakes
+start = time.perf_counter()
+fakes.import_prompts()
+{extra}
+elapsed = time.perf_counter() - start
+print(elapsed, 'qrcode' in sys.modules)
+"""
+
+
+def sample(extra, runs):
+    times = []
+    loaded = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", SNIPPET.format(here=HERE, extra=extra)],
+                             check=True, capture_output=True, text=True).stdout.split()
+        times.append(float(out[0]))
+        loaded = out[1] == "True"
+    return {'median_ms': round(statistics.median(times) * 1e3, 2),
+            'min_ms': round(min(times) * 1e3, 2), 'qrcode_loaded': loaded}
+
+
+def available(module):
+    return subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True).returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--runs', type=int, default=15)
+    args = parser.parse_args()
+    result = {'lazy': sample("", args.runs)}
+    if available("qrcode") and available("PIL.Image"):
+        # The module as it was: same imports plus qrcode and PIL.Image at load
+        result['eager'] = sample("import qrcode\nfrom PIL import Image", args.runs)
+        result['saved_ms'] = round(result['eager']['median_ms'] - result['lazy']['median_ms'], 2)
+    else:
+        result['eager'] = "qrcode or PIL not installed, nothing to compare"
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
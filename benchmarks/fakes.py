@@ -0,0 +1,323 @@
+"""Stand-ins for the Klipper and KlipperScreen objects the maintenance scripts talk to
+
+Only what yumi_maintenance.py, check_maintenance.py and prompts.py use is
+implemented; everything runs in-process without Klipper, Moonraker or a display.
+"""
+import builtins
+import collections
+import importlib
+import os
+import sys
+import time
+import types
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+if SCRIPTS not in sys.path:
+    sys.path.insert(0, SCRIPTS)
+
+
+class FakeReactor:
+    NEVER = 9999999999999999.
+    NOW = 0.
+
+    def __init__(self):
+        self.timers = []
+        # Filled from the database writer thread too, deque appends are atomic
+        self.callbacks = collections.deque()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def register_timer(self, callback, waketime=NEVER):
+        timer = [callback, waketime]
+        self.timers.append(timer)
+        return timer
+
+    def update_timer(self, timer, waketime):
+        timer[1] = waketime
+
+    def unregister_timer(self, timer):
+        self.timers.remove(timer)
+
+    def register_callback(self, callback, waketime=NOW):
+        self.callbacks.append(callback)
+
+    register_async_callback = register_callback
+
+    def run_pending(self, until=None):
+        """Run queued callbacks, then every timer due by until (default: now)"""
+        while self.callbacks:
+            self.callbacks.popleft()(self.monotonic())
+        now = self.monotonic() if until is None else until
+        for timer in list(self.timers):
+            if timer[1] <= now:
+                timer[1] = timer[0](now)
+
+
+class FakeGCodeCommand:
+    class error(Exception):
+        pass
+
+    def __init__(self, gcode, params):
+        self.gcode = gcode
+        self.params = {k.upper(): str(v) for k, v in params.items()}
+
+    def get(self, name, default=None):
+        return self.params.get(name, default)
+
+    def get_int(self, name, default=None, minval=None, maxval=None):
+        return int(self.params.get(name, default))
+
+    def get_float(self, name, default=None, minval=None, maxval=None, above=None, below=None):
+        return float(self.params.get(name, default))
+
+    def respond_info(self, msg, log=True):
+        self.gcode.responses.append(msg)
+
+    def respond_raw(self, msg):
+        self.gcode.responses.append(msg)
+
+    respond_error = respond_info
+
+
+class FakeGCode:
+    def __init__(self):
+        self.commands = {}
+        self.responses = []
+        self.scripts = []
+
+    def register_command(self, name, func, when_not_ready=False, desc=None):
+        self.commands[name] = func
+
+    def run_script_from_command(self, script):
+        self.scripts.append(script)
+
+    run_script = run_script_from_command
+
+    def respond_raw(self, msg):
+        self.responses.append(msg)
+
+    respond_info = respond_raw
+
+    def run(self, name, **params):
+        """Call a registered command like a console line would"""
+        gcmd = FakeGCodeCommand(self, params)
+        self.commands[name](gcmd)
+        return gcmd
+
+
+class FakePrinter:
+    class config_error(Exception):
+        pass
+
+    command_error = FakeGCodeCommand.error
+
+    def __init__(self):
+        self.reactor = FakeReactor()
+        self.gcode = FakeGCode()
+        self.objects = {'gcode': self.gcode}
+        self.event_handlers = {}
+        self.start_args = {}
+
+    def get_reactor(self):
+        return self.reactor
+
+    def get_start_args(self):
+        return self.start_args
+
+    def lookup_object(self, name, default=config_error):
+        if name in self.objects:
+            return self.objects[name]
+        if default is FakePrinter.config_error:
+            raise self.config_error(f"Unknown config object '{name}'")
+        return default
+
+    def load_object(self, config, name, default=None):
+        return self.objects.get(name, default)
+
+    def register_event_handler(self, event, callback):
+        self.event_handlers.setdefault(event, []).append(callback)
+
+    def send_event(self, event, *params):
+        return [cb(*params) for cb in self.event_handlers.get(event, [])]
+
+
+class FakeConfig:
+    """One config section; sections maps every section name of the fake printer.cfg to its options"""
+    def __init__(self, printer, name, options=None, sections=None):
+        self.printer = printer
+        self.name = name
+        self.options = options or {}
+        self.sections = sections if sections is not None else {name: self.options}
+        self.error = printer.config_error
+
+    def get_printer(self):
+        return self.printer
+
+    def get_name(self):
+        return self.name
+
+    def get(self, option, default=None):
+        return str(self.options.get(option, default)) if option in self.options else default
+
+    def getint(self, option, default=None, minval=None, maxval=None):
+        return int(self.options.get(option, default))
+
+    def getfloat(self, option, default=None, minval=None, maxval=None, above=None, below=None):
+        return float(self.options.get(option, default))
+
+    def getboolean(self, option, default=None):
+        value = self.options.get(option, default)
+        if isinstance(value, str):
+            return value.lower() in ('true', '1', 'yes')
+        return value
+
+    def get_prefix_options(self, prefix):
+        return [o for o in self.options if o.startswith(prefix)]
+
+    def get_prefix_sections(self, prefix):
+        return [FakeConfig(self.printer, name, options, self.sections)
+                for name, options in self.sections.items() if name.startswith(prefix)]
+
+
+class FakePrintStats:
+    def __init__(self):
+        self.print_duration = 0.
+        self.filament_used = 0.
+        self.state = "standby"
+
+    def get_status(self, eventtime):
+        return {'print_duration': self.print_duration, 'filament_used': self.filament_used,
+                'state': self.state}
+
+
+class FakeTrapQ:
+    """motion_report's toolhead trapq dump over a fixed list of moves
+
+    moves have the struct pull_move fields; extract_trapq returns them with
+    (buffer, count) pairs like DumpTrapQ does with its cffi arrays."""
+    def __init__(self, moves):
+        import bisect
+        import struct
+        self.bisect = bisect.bisect_right
+        self.moves = moves
+        self.print_times = [m.print_time for m in moves]
+        self.packed = memoryview(b"".join(struct.pack("10d", *m) for m in moves))
+
+    def extract_trapq(self, start_time, end_time):
+        # A move starting before start_time may still overlap the window
+        first = max(self.bisect(self.print_times, start_time) - 1, 0)
+        last = self.bisect(self.print_times, end_time)
+        size = 10 * 8
+        return self.moves[first:last], [(self.packed[first * size:last * size], last - first)]
+
+
+class FakeMCU:
+    def estimated_print_time(self, eventtime):
+        return eventtime
+
+
+class FakeFFI:
+    """cffi's ffi.buffer for FakeTrapQ buffers, which already are buffers"""
+    def buffer(self, data):
+        return data
+
+
+def load_maintenance(workdir, options=None, sections=None):
+    """A YumiMaintenance on a fake printer whose printer_data folder is workdir
+
+    The database ends up in workdir/database and the log in workdir/logs.
+    Returns (module, printer, instance)."""
+    import yumi_maintenance
+    options = dict(options or {})
+    sections = dict(sections or {})
+    sections['yumi_maintenance'] = options
+    printer = FakePrinter()
+    printer.start_args = {'config_file': os.path.join(workdir, "config", "printer.cfg"),
+                          'log_file': os.path.join(workdir, "logs", "klippy.log")}
+    printer.objects['print_stats'] = FakePrintStats()
+    maintenance = yumi_maintenance.load_config(FakeConfig(printer, 'yumi_maintenance', options, sections))
+    return yumi_maintenance, printer, maintenance
+
+
+class Headless:
+    """Accepts any attribute access or call, standing in for GTK objects without a display"""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Headless()
+
+    def __call__(self, *args, **kwargs):
+        return Headless()
+
+    def __iter__(self):
+        return iter(())
+
+    def __mul__(self, other):
+        return 0
+
+    __rmul__ = __add__ = __radd__ = __mul__
+
+
+def import_prompts():
+    """Import prompts.py with the real GTK when available, else a headless stand-in
+
+    Returns (module, 'real' or 'headless')."""
+    builtins._ = getattr(builtins, '_', lambda text: text)
+    try:
+        import gi
+        gi.require_version("Gtk", "3.0")
+        from gi.repository import Gtk
+        if not Gtk.init_check(sys.argv)[0]:
+            raise ImportError("no display")
+        mode = "real"
+    except (ImportError, ValueError):
+        mode = "headless"
+        gi = types.ModuleType("gi")
+        gi.require_version = lambda *args: None
+        repository = types.ModuleType("gi.repository")
+        for name in ("Gtk", "Gdk", "GdkPixbuf", "GLib"):
+            setattr(repository, name, Headless())
+        gi.repository = repository
+        sys.modules["gi"] = gi
+        sys.modules["gi.repository"] = repository
+    return importlib.import_module("prompts"), mode
+
+
+class HeadlessGtk:
+    """The parts of KlipperScreen's KlippyGtk used by the prompt widget, drawing nothing"""
+    bsidescale = 1.
+
+    def __init__(self):
+        self.dialogs = 0
+
+    def Button(self, image_name=None, label=None, style=None, scale=None):
+        return Headless()
+
+    def ScrolledWindow(self, steppers=True):
+        return Headless()
+
+    def Dialog(self, title, buttons, content, callback=None, *args):
+        self.dialogs += 1
+        return Headless()
+
+    def remove_dialog(self, dialog):
+        self.dialogs -= 1
+
+
+class HeadlessScreen:
+    """KlipperScreen's screen as seen by Prompt: gtk helpers, screensaver and actions"""
+    windowed = False
+
+    def __init__(self):
+        self.gtk = HeadlessGtk()
+        self.prompt = None
+        self.screensaver = self
+        self.actions = []
+
+    def close(self):
+        pass
+
+    def _send_action(self, widget, method, params):
+        self.actions.append((method, params))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Offline benchmarks of the maintenance scripts on fake Klipper/KlipperScreen objects
+
+Results are written as JSON; pass an earlier file with --compare to print
+how every metric moved, e.g.
+    python3 benchmarks/run_benchmarks.py --output before.json
+    python3 benchmarks/run_benchmarks.py --compare before.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import fakes
+
+import check_maintenance
+
+
+def summarize(durations):
+    """Microsecond statistics of a list of durations in seconds"""
+    durations = sorted(durations)
+    count = len(durations)
+    return {'count': count,
+            'mean_us': round(sum(durations) / count * 1e6, 2),
+            'p50_us': round(durations[count // 2] * 1e6, 2),
+            'p99_us': round(durations[min(count - 1, int(count * .99))] * 1e6, 2),
+            'max_us': round(durations[-1] * 1e6, 2)}
+
+
+def timed(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def task_sections(count):
+    """One templated section expanding to count tasks, or None for the built-in six"""
+    if count is None:
+        return None
+    return {'yumi_maintenance_task task_{component}': {
+        'components': ", ".join(f"c{i:04d}" for i in range(count)),
+        'interval_days': "30",
+        'interval_print_hours': "100",
+        'message': "Service {component}",
+        'prompt': "Code: X00 - MAINTENANCE: Service {component} Scan for complete guide",
+        'image': "/home/pi/KlipperScreen/styles/maintenance/xyz.png",
+    }}
+
+
+@contextlib.contextmanager
+def maintenance(count=None, options=None, workdir=None):
+    """A ready YumiMaintenance with count tasks, disconnected on exit"""
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        module, printer, instance = fakes.load_maintenance(workdir, options, task_sections(count))
+        printer.send_event("klippy:ready")
+        printer.reactor.run_pending()
+        try:
+            yield module, printer, instance
+        finally:
+            printer.send_event("klippy:disconnect")
+
+
+def bench_init(counts, repeat):
+    """Restart time split into config load and klippy:ready, on a new and an existing database"""
+    results = {}
+    for count in counts:
+        durations = {(db, phase): [] for db in ('new_database', 'existing_database')
+                     for phase in ('config', 'ready', 'total')}
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as workdir:
+                for db in ('new_database', 'existing_database'):
+                    start = time.perf_counter()
+                    module, printer, instance = fakes.load_maintenance(workdir, None, task_sections(count))
+                    loaded = time.perf_counter()
+                    printer.send_event("klippy:ready")
+                    printer.reactor.run_pending()
+                    ready = time.perf_counter()
+                    printer.send_event("klippy:disconnect")
+                    durations[db, 'config'].append(loaded - start)
+                    durations[db, 'ready'].append(ready - loaded)
+                    durations[db, 'total'].append(ready - start)
+        label = str(count or 6)
+        results[label] = {}
+        for (db, phase), values in durations.items():
+            results[label].setdefault(db, {})[phase] = summarize(values)
+    return results
+
+
+def bench_commands(repeat):
+    results = {}
+    with maintenance() as (module, printer, instance):
+        names = [task.name for task in instance.tasks]
+        for command in ("MAINTENANCE_CONFIRM", "MAINTENANCE_POSTPONE"):
+            durations = []
+            for i in range(repeat):
+                name = names[i % len(names)]
+                instance._tasks_due([name])
+                start = time.perf_counter()
+                printer.gcode.run(command, TASK=name)
+                durations.append(time.perf_counter() - start)
+                printer.reactor.run_pending()
+            results[command] = summarize(durations)
+        instance.store.flush_sync()
+    return results
+
+
+def bench_status(counts, repeat):
+    results = {}
+    for count in counts:
+        with maintenance(count) as (module, printer, instance):
+            names = [task.name for task in instance.tasks]
+
+            def rebuild():
+                instance._status_changed(names)
+                instance.get_status(0.)
+            results[str(len(names))] = {
+                'get_status_rebuild': timed(rebuild, repeat),
+                'get_status_one_task_changed': timed(
+                    lambda: (instance._status_changed(names[:1]), instance.get_status(0.)), repeat),
+                'get_status_cached': timed(lambda: instance.get_status(0.), repeat * 10),
+                'MAINTENANCE_STATUS': timed(lambda: printer.gcode.run("MAINTENANCE_STATUS"), repeat),
+            }
+    return results
+
+
+def bench_forecast(counts, repeat):
+    """90 day forecast of every task, with a usage rate on every counter"""
+    results = {}
+    for count in counts:
+        with maintenance(count) as (module, printer, instance):
+            now = module.datetime.now()
+            totals = instance.usage.snapshot()
+            rates = {'print_seconds': .1, 'filament_mm': .5, 'odometer_x': 20., 'odometer_y': 20.,
+                     'odometer_z': .5}
+            horizon = module.timedelta(days=90)
+            results[str(len(instance.tasks))] = {
+                'forecast': timed(lambda: module.forecast(instance.tasks, now, totals, rates, horizon), repeat),
+                'MAINTENANCE_FORECAST': timed(lambda: printer.gcode.run("MAINTENANCE_FORECAST"), repeat),
+            }
+    return results
+
+
+def bench_prompts(repeat):
+    prompts, mode = fakes.import_prompts()
+    with maintenance() as (module, printer, instance):
+        task = next(iter(instance.tasks))
+        lines = {'batch': module.compile_prompt([task], True), 'per_line': module.compile_prompt([task], False)}
+    screen = fakes.HeadlessScreen()
+    results = {'gtk': mode}
+    for label, messages in lines.items():
+        actions = [line[len("// action:"):] for line in messages]
+
+        def decode():
+            prompt = prompts.Prompt(screen)
+            for action in actions:
+                prompt.decode(action)
+            prompt.decode("prompt_end")
+
+        # Without a widget decode only parses, show/end are measured on top of it
+        results[f'{label}_decode_show_end'] = timed(decode, repeat)
+    return results
+
+
+def write_printer_cfg(path, lines):
+    with open(path, "w") as f:
+        f.write("[include mainsail.cfg]\n[save_variables]\n")
+        f.write(check_maintenance.INSERT_AFTER + "\n")
+        for i in range(max(0, lines - 3) // 4):
+            f.write(f"[gcode_macro MACRO_{i}]\ngcode:\n  G1 X{i % 200} Y{i % 180} F6000\n\n")
+
+
+def bench_check_maintenance(sizes, repeat):
+    results = {}
+    for lines in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            check_maintenance.CFG_PATH = os.path.join(workdir, "Yumi_Maintenance.cfg")
+            check_maintenance.PRINTER_CFG = os.path.join(workdir, "printer.cfg")
+            check_maintenance.STAMP_FILE = os.path.join(workdir, "stamps.json")
+            write_printer_cfg(check_maintenance.PRINTER_CFG, lines)
+            state = {'enable': False}
+
+            def set_flag(enable):
+                with open(check_maintenance.CFG_PATH, "w") as f:
+                    f.write(f"enable_maintenance={enable}\n")
+
+            def toggle():
+                state['enable'] = not state['enable']
+                set_flag(state['enable'])
+                check_maintenance.main()
+
+            def backdate():
+                # Out of the racy window, so cached stamps are trusted
+                old = time.time() - 10.
+                for path in (check_maintenance.CFG_PATH, check_maintenance.PRINTER_CFG):
+                    os.utime(path, (old, old))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(check_maintenance.STAMP_FILE)
+                check_maintenance.main()
+
+            def uncached():
+                os.remove(check_maintenance.STAMP_FILE)
+                check_maintenance.main()
+
+            result = {'bytes': 0, 'toggle': timed(toggle, repeat)}
+            backdate()
+            result['unchanged_cached'] = timed(check_maintenance.main, repeat)
+            result['unchanged_uncached'] = timed(uncached, repeat)
+            result['bytes'] = os.path.getsize(check_maintenance.PRINTER_CFG)
+            results[str(lines)] = result
+    return results
+
+
+def bench_instances(counts, lines, repeat):
+    """check_maintenance --all on a host with count Klipper instances, every round toggling all of them"""
+    results = {}
+    for count in counts:
+        with tempfile.TemporaryDirectory() as home:
+            instances = []
+            for i in range(count):
+                config_dir = os.path.join(home, f"printer_{i}_data", "config")
+                os.makedirs(config_dir)
+                instance = check_maintenance.instance_paths(config_dir)
+                write_printer_cfg(instance.printer_cfg, lines)
+                instances.append(instance)
+            state = {'enable': False}
+
+            def toggle_all():
+                state['enable'] = not state['enable']
+                for instance in instances:
+                    with open(instance.cfg_path, "w") as f:
+                        f.write(f"enable_maintenance={state['enable']}\n")
+                start = time.perf_counter()
+                check_maintenance.check_all(instances)
+                return time.perf_counter() - start
+
+            durations = [toggle_all() for _ in range(repeat)]
+            results[str(count)] = {'toggle_all': summarize(durations),
+                                   'unchanged_all': timed(lambda: check_maintenance.check_all(instances), repeat)}
+    return results
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(old, new):
+    old_values = dict(flatten(old['results']))
+    for key, value in flatten(new['results']):
+        if key.endswith(("mean_us", "p99_us")) and old_values.get(key):
+            ratio = value / old_values[key]
+            flag = "  SLOWER" if ratio > 1.2 else ("  faster" if ratio < .8 else "")
+            print(f"{key:70s} {old_values[key]:12.2f} -> {value:12.2f}  x{ratio:5.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare with")
+    parser.add_argument("--quick", action="store_true", help="fewer rounds and smaller sizes")
+    args = parser.parse_args()
+    repeat = 20 if args.quick else 200
+    counts = [None, 100] if args.quick else [None, 100, 500]
+    sizes = [1000, 10000] if args.quick else [1000, 10000, 100000]
+
+    import yumi_maintenance
+    report = {
+        'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(),
+                 'machine': platform.machine(),
+                 'numpy': yumi_maintenance.numpy is not None,
+                 'quick': args.quick},
+        'results': {},
+    }
+    benches = (
+        ('init', lambda: bench_init(counts, max(3, repeat // 20))),
+        ('commands', lambda: bench_commands(repeat)),
+        ('status', lambda: bench_status(counts, repeat)),
+        ('forecast', lambda: bench_forecast(counts, max(5, repeat // 10))),
+        ('prompts', lambda: bench_prompts(repeat)),
+        ('check_maintenance', lambda: bench_check_maintenance(sizes, max(5, repeat // 10))),
+        ('instances', lambda: bench_instances([1, 20], sizes[1], max(5, repeat // 10))),
+    )
+    for name, bench in benches:
+        start = time.perf_counter()
+        report['results'][name] = bench()
+        print(f"{name}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
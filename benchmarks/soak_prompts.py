@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Show and end thousands of maintenance prompts, reporting memory and show latency
+
+Needs GTK and a display, e.g.: xvfb-run python3 benchmarks/soak_prompts.py
+"""
+import argparse
+import builtins
+import os
+import sys
+import time
+
+import gi
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib, Gtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+builtins._ = lambda text: text
+import prompts
+
+IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "img")
+
+
+class SoakGtk:
+    """The parts of KlipperScreen's KlippyGtk used by the prompt widget"""
+    bsidescale = 1.
+
+    def Button(self, image_name=None, label=None, style=None, scale=None):
+        return Gtk.Button(label=label or image_name)
+
+    def ScrolledWindow(self, steppers=True):
+        return Gtk.ScrolledWindow()
+
+    def Dialog(self, title, buttons, content, callback=None, *args):
+        dialog = Gtk.Dialog(title=title)
+        for button in buttons:
+            dialog.add_button(button['name'], button['response'])
+        dialog.get_content_area().add(content)
+        if callback is not None:
+            dialog.connect("response", callback, *args)
+        dialog.show_all()
+        return dialog
+
+    def remove_dialog(self, dialog):
+        dialog.destroy()
+
+
+class SoakScreen:
+    windowed = False
+
+    def __init__(self):
+        self.gtk = SoakGtk()
+        self.prompt = None
+        self.screensaver = self
+
+    def close(self):
+        pass
+
+    def _send_action(self, *args):
+        pass
+
+
+def rss_kib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def pump():
+    while Gtk.events_pending():
+        Gtk.main_iteration_do(False)
+
+
+def soak(count, report_every):
+    screen = SoakScreen()
+    images = sorted(os.path.join(IMAGES, name) for name in os.listdir(IMAGES) if name.endswith(".png"))
+    window = []
+    print(f"{'prompts':>8} {'rss KiB':>10} {'show ms':>9}")
+    for i in range(1, count + 1):
+        prompt = prompts.Prompt(screen)
+        for action in ("prompt_begin Maintenance Required",
+                       f"prompt_text Code: A0{i % 10} - MAINTENANCE: soak prompt {i}",
+                       f"prompt_image {images[i % len(images)]}",
+                       "prompt_button Done|MAINTENANCE_CONFIRM TASK=soak|primary",
+                       "prompt_footer_button Not Now|MAINTENANCE_POSTPONE TASK=soak",
+                       "prompt_footer_button Confirm|MAINTENANCE_CONFIRM TASK=soak"):
+            prompt.decode(action)
+        start = time.perf_counter()
+        prompt.decode("prompt_show")
+        pump()
+        window.append(time.perf_counter() - start)
+        prompt.decode("prompt_end")
+        pump()
+        if i % report_every == 0:
+            print(f"{i:8d} {rss_kib():10d} {1000. * sum(window) / len(window):9.2f}")
+            window = []
+    print(f"pixbuf cache: {prompts.pixbuf_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt widget soak test")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--report-every", type=int, default=500)
+    args = parser.parse_args()
+    GLib.set_prgname("soak_prompts")
+    soak(args.count, args.report_every)
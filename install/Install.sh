@@ -20,24 +20,28 @@ if [ ! -f "$CONFIG_DIR/Yumi_Maintenance.cfg" ]; then
     install -Dm644 ../config/Yumi_Maintenance.cfg "$CONFIG_DIR/Yumi_Maintenance.cfg"
 fi
 
-# Copier images
-mkdir -p "$MAINTENANCE_STYLE"
-cp ../img/*.png "$MAINTENANCE_STYLE/"
-
-# Permissions sécurisées
+# Copier les images 200x200 de img/display, seulement celles qui ont changé
+# (voir build_assets.py pour les régénérer depuis img/)
+python3 build_assets.py check
+python3 build_assets.py install "$MAINTENANCE_STYLE" --owner pi:pi
 chmod 755 "$MAINTENANCE_STYLE"
-chmod 644 "$MAINTENANCE_STYLE"/*.png
-chown -R pi:pi "$MAINTENANCE_STYLE"
 
-# Copier script check_maintenance.py
+# Copier les scripts check_maintenance.py, maintenance_feed.py et maintenance_forecast.py
+# (maintenance_forecast.py importe yumi_maintenance.py et maintenance_collector.py)
 install -Dm755 ../scripts/check_maintenance.py /home/pi/Yumi_Maintenance/scripts/check_maintenance.py
+install -Dm755 ../scripts/maintenance_feed.py /home/pi/Yumi_Maintenance/scripts/maintenance_feed.py
+install -Dm755 ../scripts/maintenance_forecast.py /home/pi/Yumi_Maintenance/scripts/maintenance_forecast.py
+install -Dm644 ../scripts/maintenance_collector.py /home/pi/Yumi_Maintenance/scripts/maintenance_collector.py
+install -Dm644 ../scripts/yumi_maintenance.py /home/pi/Yumi_Maintenance/scripts/yumi_maintenance.py
 
-# Installer service et timer
+# Installer les services et le timer (le timer reste disponible en secours)
 sudo install -Dm644 ../service/yumi_maintenance.service /etc/systemd/system/yumi_maintenance.service
 sudo install -Dm644 ../service/yumi_maintenance.timer /etc/systemd/system/yumi_maintenance.timer
+sudo install -Dm644 ../service/yumi_maintenance_watch.service /etc/systemd/system/yumi_maintenance_watch.service
 
-# Activer le timer
+# Activer la surveillance inotify à la place du timer
 sudo systemctl daemon-reload
-sudo systemctl enable --now yumi_maintenance.timer
+sudo systemctl disable --now yumi_maintenance.timer 2>/dev/null || true
+sudo systemctl enable --now yumi_maintenance_watch.service
 
 echo "[Yumi_Maintenance] Installation terminée."
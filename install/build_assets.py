@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Build display-size maintenance images and install them incrementally
+
+build (needs Pillow, run when img/*.png change, the output is committed):
+    python3 build_assets.py build
+check the committed images against their manifest:
+    python3 build_assets.py check
+copy only new or changed images to KlipperScreen:
+    python3 build_assets.py install /home/pi/KlipperScreen/styles/maintenance --owner pi:pi
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SOURCE_DIR = os.path.join(ROOT, "img")
+BUILD_DIR = os.path.join(ROOT, "img", "display")
+MANIFEST = "manifest.json"
+# Same as VISUAL_SIZE in prompts.py
+SIZE = 200
+# Shipped before the manifest existed, removed on install
+LEGACY_FILES = ("Belt_Tension.png",)
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'size': None, 'files': {}}
+
+
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def render(src, dst, size):
+    """src scaled to fit size x size, written as an optimized PNG without metadata"""
+    from PIL import Image
+    with Image.open(src) as image:
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".tmp_", suffix=".png")
+        os.close(fd)
+        image.save(tmp, "PNG", optimize=True)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, dst)
+
+
+def build(size=SIZE, source_dir=SOURCE_DIR, build_dir=BUILD_DIR):
+    """Render images whose source or size changed; returns the names written"""
+    os.makedirs(build_dir, exist_ok=True)
+    old = read_manifest(build_dir)
+    files = {}
+    written = []
+    for source in sorted(n for n in os.listdir(source_dir) if n.lower().endswith(".png")):
+        # Lower case names, task image paths are matched exactly
+        name = source.lower()
+        if name in files:
+            raise ValueError(f"{source} and {files[name]['source']} both build {name}")
+        src = os.path.join(source_dir, source)
+        dst = os.path.join(build_dir, name)
+        entry = {'source': source, 'source_sha256': sha256(src)}
+        previous = old['files'].get(name, {})
+        if (old['size'] != size or previous.get('source_sha256') != entry['source_sha256']
+                or not os.path.exists(dst) or sha256(dst) != previous.get('sha256')):
+            render(src, dst, size)
+            written.append(name)
+        entry['sha256'] = sha256(dst)
+        files[name] = entry
+    for name in set(old['files']) - set(files):
+        if os.path.exists(os.path.join(build_dir, name)):
+            os.remove(os.path.join(build_dir, name))
+    manifest = {'size': size, 'files': files}
+    write_atomic(os.path.join(build_dir, MANIFEST),
+                 (json.dumps(manifest, indent=1, sort_keys=True) + "\n").encode())
+    return written
+
+
+def check(build_dir=BUILD_DIR, source_dir=SOURCE_DIR):
+    """Problems with the built images, empty when they match the manifest and the sources"""
+    manifest = read_manifest(build_dir)
+    problems = []
+    if not manifest['files']:
+        problems.append(f"no {MANIFEST} in {build_dir}, run build")
+    for name, entry in sorted(manifest['files'].items()):
+        path = os.path.join(build_dir, name)
+        if not os.path.exists(path) or sha256(path) != entry['sha256']:
+            problems.append(f"{name} does not match the manifest")
+        src = os.path.join(source_dir, entry['source'])
+        if os.path.exists(source_dir) and (not os.path.exists(src) or sha256(src) != entry['source_sha256']):
+            problems.append(f"{entry['source']} changed since the last build")
+    return problems
+
+
+def install(dest, owner=None, build_dir=BUILD_DIR):
+    """Copy the images that differ from what dest's manifest lists; returns (copied, removed)"""
+    os.makedirs(dest, exist_ok=True)
+    manifest = read_manifest(build_dir)
+    installed = read_manifest(dest)
+    copied = []
+    for name, entry in sorted(manifest['files'].items()):
+        path = os.path.join(dest, name)
+        if installed['files'].get(name, {}).get('sha256') == entry['sha256'] and os.path.exists(path):
+            continue
+        with open(os.path.join(build_dir, name), "rb") as f:
+            write_atomic(path, f.read())
+        copied.append(path)
+    removed = []
+    for name in (set(installed['files']) - set(manifest['files'])) | set(LEGACY_FILES):
+        path = os.path.join(dest, name)
+        if name not in manifest['files'] and os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    # Written last, an interrupted install is simply redone next time
+    manifest_path = os.path.join(dest, MANIFEST)
+    shutil.copyfile(os.path.join(build_dir, MANIFEST), manifest_path)
+    if owner:
+        user, _, group = owner.partition(":")
+        for path in copied + [manifest_path, dest]:
+            shutil.chown(path, user, group or None)
+    return copied, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build")
+    build_parser.add_argument("--size", type=int, default=SIZE)
+    sub.add_parser("check")
+    install_parser = sub.add_parser("install")
+    install_parser.add_argument("dest")
+    install_parser.add_argument("--owner", help="user[:group] of copied files")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            written = build(args.size)
+        except ImportError:
+            print("build needs Pillow: pip install Pillow", file=sys.stderr)
+            return 1
+        print(f"{len(written)} image(s) rebuilt: {', '.join(written) or '-'}")
+    elif args.command == "check":
+        problems = check()
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return 1 if problems else 0
+    else:
+        copied, removed = install(args.dest, args.owner)
+        print(f"{len(copied)} image(s) copied, {len(removed)} removed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,55 +1,377 @@
 #!/usr/bin/env python3
+import argparse
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import glob
+import json
 import os
+import re
+import select
+import stat
+import struct
+import sys
+import tempfile
+import time
 
 CFG_PATH = "/home/pi/printer_data/config/Yumi_Maintenance.cfg"
 PRINTER_CFG = "/home/pi/printer_data/config/printer.cfg"
 MARKER = "[yumi_maintenance]"
 INSERT_AFTER = "filename: ~/printer_data/config/variables.cfg"
+STAMP_FILE = "/home/pi/printer_data/database/yumi_maintenance_check.json"
+RACY_WINDOW_NS = 1000000000
+# Klipper instances side by side, as KIAUH installs them: ~/printer_data, ~/printer_2_data, ...
+HOME_DIR = "/home/pi"
+INSTANCE_GLOB = "*_data"
 
-def read_enable_flag():
-    if not os.path.exists(CFG_PATH):
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+# Stands for every watch when the kernel queue overflowed and events were lost
+OVERFLOW = (-1, None)
+# [yumi_maintenance] and [yumi_maintenance_task NAME] are only valid while the
+# module is loaded; disabling comments them out with their options, enabling restores them
+SECTION = rb"\[yumi_maintenance(?:_task [^\]\n]*)?\]"
+DISABLED_PREFIX = b"#~ "
+# Header line at the start of a line, then every line up to the next section or SAVE_CONFIG block
+ACTIVE_SECTION = re.compile(rb"^" + SECTION + rb"[^\n]*\n(?:(?!\[|#\*#|#~ \[)[^\n]*\n)*", re.M)
+DISABLED_SECTION = re.compile(rb"^#~ " + SECTION + rb"[^\n]*\n(?:(?:#~ [^\n]*|[ \t]*)\n)*", re.M)
+ACTIVE_MARKER = re.compile(rb"^" + re.escape(MARKER.encode()), re.M)
+
+Instance = collections.namedtuple("Instance", "name cfg_path printer_cfg stamp_file")
+
+def instance_paths(config_dir):
+    """Instance of a printer_data/config directory"""
+    config_dir = os.path.normpath(config_dir)
+    data_dir = os.path.dirname(config_dir)
+    return Instance(os.path.basename(data_dir),
+                    os.path.join(config_dir, os.path.basename(CFG_PATH)),
+                    os.path.join(config_dir, os.path.basename(PRINTER_CFG)),
+                    os.path.join(data_dir, "database", os.path.basename(STAMP_FILE)))
+
+def default_instance():
+    return Instance(os.path.basename(os.path.dirname(os.path.dirname(CFG_PATH))),
+                    CFG_PATH, PRINTER_CFG, STAMP_FILE)
+
+def discover_instances(home=None):
+    """Every HOME_DIR/*_data/config holding a printer.cfg"""
+    pattern = os.path.join(home or HOME_DIR, INSTANCE_GLOB, "config", os.path.basename(PRINTER_CFG))
+    return [instance_paths(os.path.dirname(path)) for path in sorted(glob.glob(pattern))]
+
+def read_instances(manifest):
+    """Config directories listed one per line, '#' starts a comment"""
+    instances = []
+    with open(manifest, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                instances.append(instance_paths(os.path.expanduser(line)))
+    return instances
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def stamp_is_fresh(cached, stamp):
+    """A cached stamp is only trusted if the file was not written in the second it was checked"""
+    return (cached is not None and cached["stamp"] == stamp
+            and stamp[0] < cached["checked"] - RACY_WINDOW_NS)
+
+def load_stamps(stamp_file=None):
+    try:
+        with open(stamp_file or STAMP_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_stamps(stamps, stamp_file=None):
+    stamp_file = stamp_file or STAMP_FILE
+    try:
+        os.makedirs(os.path.dirname(stamp_file), exist_ok=True)
+        tmp = stamp_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(stamps, f)
+        os.replace(tmp, stamp_file)
+    except OSError:
+        pass
+
+def read_enable_flag(stamps=None, cfg_path=None):
+    stamps = {} if stamps is None else stamps
+    cfg_path = cfg_path or CFG_PATH
+    stamp = file_stamp(cfg_path)
+    if stamp is None:
         return False
-    with open(CFG_PATH, "r") as f:
+    cached = stamps.get(cfg_path)
+    if stamp_is_fresh(cached, stamp):
+        return cached["enable"]
+    enable = False
+    with open(cfg_path, "r") as f:
         for line in f:
             if line.strip().startswith("enable_maintenance"):
-                return line.strip().split("=")[1].strip().lower() == "true"
-    return False
+                enable = line.strip().split("=")[1].strip().lower() == "true"
+                break
+    stamps[cfg_path] = {"stamp": stamp, "checked": time.time_ns(), "enable": enable}
+    return enable
+
+def atomic_write(path, data):
+    """Replace path with data so a power loss leaves either the old or the new file
+
+    A symlinked path is resolved first, the link is kept and its target replaced."""
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    st = os.stat(path)
+    fd, tmp = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, stat.S_IMODE(st.st_mode))
+        try:
+            os.chown(tmp, st.st_uid, st.st_gid)
+        except PermissionError:
+            pass
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def disable_sections(data):
+    return ACTIVE_SECTION.sub(lambda m: re.sub(rb"^(?=[^\n])", DISABLED_PREFIX, m.group(), flags=re.M), data)
+
+def restore_sections(data):
+    return DISABLED_SECTION.sub(lambda m: re.sub(rb"^#~ ", b"", m.group(), flags=re.M), data)
 
-def printer_cfg_contains_marker():
-    if not os.path.exists(PRINTER_CFG):
+def rewrite_printer_cfg(enable, printer_cfg=None):
+    """Read printer.cfg once and rewrite it only if the marker must change
+
+    Disabling comments out [yumi_maintenance] and the task sections together
+    with their options, which Klipper would otherwise reject or attach to
+    the section above; enabling restores them, or inserts a bare marker.
+    Works on the whole buffer with regular expressions instead of looping
+    over lines in Python, which keeps the CPU part small enough for
+    instances to be checked in threads.
+    Returns (changed, has_marker)."""
+    printer_cfg = printer_cfg or PRINTER_CFG
+    with open(printer_cfg, "rb") as f:
+        data = f.read()
+    work = data if not data or data.endswith(b"\n") else data + b"\n"
+    found = ACTIVE_MARKER.search(work) is not None
+    if enable:
+        if found and not DISABLED_SECTION.search(work):
+            return False, True
+        new = restore_sections(work)
+        if not ACTIVE_MARKER.search(new):
+            start = new.find(INSERT_AFTER.encode())
+            if start < 0:
+                # Task sections without the module would stop Klipper, leave them disabled
+                return False, found
+            end = new.index(b"\n", start)
+            new = new[:end + 1] + MARKER.encode() + b"\n" + new[end + 1:]
+        atomic_write(printer_cfg, new)
+        return True, True
+    if not ACTIVE_SECTION.search(work):
+        return False, False
+    atomic_write(printer_cfg, disable_sections(work))
+    return True, False
+
+def reconcile(enable, stamps, printer_cfg=None):
+    """Bring printer.cfg in line with enable; returns True if it was rewritten"""
+    printer_cfg = printer_cfg or PRINTER_CFG
+    stamp = file_stamp(printer_cfg)
+    if stamp is None:
         return False
-    with open(PRINTER_CFG, "r") as f:
-        return MARKER in f.read()
-
-def add_marker():
-    lines = []
-    with open(PRINTER_CFG, "r") as f:
-        lines = f.readlines()
-    new_lines = []
-    inserted = False
-    for line in lines:
-        new_lines.append(line)
-        if INSERT_AFTER in line and not inserted:
-            new_lines.append(MARKER + "\n")
-            inserted = True
-    if inserted:
-        with open(PRINTER_CFG, "w") as f:
-            f.writelines(new_lines)
-
-def remove_marker():
-    with open(PRINTER_CFG, "r") as f:
-        lines = f.readlines()
-    new_lines = [l for l in lines if MARKER not in l]
-    with open(PRINTER_CFG, "w") as f:
-        f.writelines(new_lines)
+    cached = stamps.get(printer_cfg)
+    if stamp_is_fresh(cached, stamp) and cached["has_marker"] == enable:
+        # Unchanged since the last run and already in the wanted state
+        return False
+    changed, has_marker = rewrite_printer_cfg(enable, printer_cfg)
+    stamps[printer_cfg] = {"stamp": file_stamp(printer_cfg), "checked": time.time_ns(),
+                           "has_marker": has_marker}
+    return changed
+
+def check(instance):
+    """Reconcile one instance; returns (enable, changed)"""
+    stamps = load_stamps(instance.stamp_file)
+    before = json.dumps(stamps, sort_keys=True)
+    enable = read_enable_flag(stamps, instance.cfg_path)
+    changed = reconcile(enable, stamps, instance.printer_cfg)
+    if json.dumps(stamps, sort_keys=True) != before:
+        save_stamps(stamps, instance.stamp_file)
+    return enable, changed
 
 def main():
-    enable = read_enable_flag()
-    has_marker = printer_cfg_contains_marker()
-    if enable and not has_marker:
-        add_marker()
-    elif not enable and has_marker:
-        remove_marker()
+    return check(default_instance())
+
+def timed_check(instance):
+    """(instance, outcome, seconds), errors are reported instead of raised"""
+    start = time.perf_counter()
+    if not os.path.exists(instance.printer_cfg):
+        return instance, f"error: {instance.printer_cfg} not found", time.perf_counter() - start
+    try:
+        enable, changed = check(instance)
+        outcome = ("marker added" if enable else "marker removed") if changed else "unchanged"
+    except OSError as e:
+        outcome = f"error: {e}"
+    return instance, outcome, time.perf_counter() - start
+
+def check_all(instances, workers=None):
+    """Reconcile instances concurrently, most of the time goes to fsync"""
+    if len(instances) <= 1:
+        return [timed_check(instance) for instance in instances]
+    with concurrent.futures.ThreadPoolExecutor(workers or min(32, len(instances))) as pool:
+        return list(pool.map(timed_check, instances))
+
+def print_summary(results, elapsed, changed_only=False):
+    for instance, outcome, duration in results:
+        if not changed_only or outcome != "unchanged":
+            print(f"{instance.name}: {outcome} ({duration * 1000.:.1f} ms)", flush=True)
+    if not changed_only:
+        print(f"{len(results)} instance(s) in {elapsed * 1000.:.1f} ms", flush=True)
+
+def inotify_open(paths):
+    """Return (fd, watch descriptors) of one inotify fd watching every path, or None when unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    wds = [libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) for path in paths]
+    if min(wds, default=-1) < 0:
+        os.close(fd)
+        return None
+    return fd, wds
+
+def read_events(fd):
+    """(watch descriptor, name) of the files touched in one read, None if a watch went away
+
+    A queue overflow is reported as OVERFLOW, whatever changed is unknown then."""
+    data = os.read(fd, 64 * 1024)
+    names = set()
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+        offset += length
+        if mask & (IN_DELETE_SELF | IN_IGNORED):
+            return None
+        if mask & IN_Q_OVERFLOW:
+            names.add(OVERFLOW)
+            continue
+        names.add((wd, name))
+    return names
+
+def poll(instances, interval, summary=False, workers=None):
+    """Reconcile every interval seconds, the watcher's fallback without inotify
+
+    Unchanged files are skipped on their cached stamps, so a pass costs a few stat calls."""
+    while True:
+        time.sleep(interval)
+        start = time.perf_counter()
+        results = check_all(instances, workers)
+        if summary:
+            print_summary(results, time.perf_counter() - start, changed_only=True)
+
+def watch(instances, debounce, max_delay, summary=False, workers=None, poll_interval=5.0):
+    watched = {os.path.basename(CFG_PATH), os.path.basename(PRINTER_CFG)}
+    start = time.perf_counter()
+    results = check_all(instances, workers)
+    if summary:
+        print_summary(results, time.perf_counter() - start)
+    opened = inotify_open([os.path.dirname(instance.cfg_path) for instance in instances])
+    if opened is None:
+        # Exiting would only make systemd restart the watcher over and over
+        print(f"inotify unavailable, checking every {poll_interval:g} s instead", file=sys.stderr, flush=True)
+        return poll(instances, poll_interval, summary, workers)
+    fd, wds = opened
+    by_wd = dict(zip(wds, instances))
+
+    def touched(events):
+        if OVERFLOW in events:
+            return set(instances)
+        return {by_wd[wd] for wd, name in events if name in watched and wd in by_wd}
+
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    while True:
+        # Sleep until something changes in a config directory
+        poller.poll()
+        events = read_events(fd)
+        if events is None:
+            return 1
+        changed = touched(events)
+        if not changed:
+            continue
+        # Let editors finish their burst of writes/renames before reconciling
+        deadline = time.monotonic() + max_delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not poller.poll(min(debounce, remaining) * 1000.):
+                break
+            events = read_events(fd)
+            if events is None:
+                return 1
+            changed.update(touched(events))
+        start = time.perf_counter()
+        results = check_all(sorted(changed), workers)
+        if summary:
+            print_summary(results, time.perf_counter() - start, changed_only=True)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Sync [yumi_maintenance] in printer.cfg with Yumi_Maintenance.cfg")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and reconcile on config changes (inotify)")
+    parser.add_argument("--debounce", type=float, default=0.3,
+                        help="quiet time in seconds before applying a burst of changes")
+    parser.add_argument("--max-delay", type=float, default=1.0,
+                        help="longest time in seconds a change can wait while events keep arriving")
+    parser.add_argument("--poll-interval", type=float, default=5.0,
+                        help="seconds between checks when --watch has no inotify")
+    parser.add_argument("--all", action="store_true",
+                        help=f"every Klipper instance found as {HOME_DIR}/{INSTANCE_GLOB}/config")
+    parser.add_argument("--instances", metavar="FILE",
+                        help="file listing the config directory of each instance, one per line")
+    parser.add_argument("--workers", type=int, help="instances reconciled in parallel (default: all, up to 32)")
+    args = parser.parse_args()
+    multi = args.all or args.instances
+    if args.instances:
+        instances = read_instances(args.instances)
+    elif args.all:
+        instances = discover_instances()
+    else:
+        instances = [default_instance()]
+    if not instances:
+        print("no Klipper instance found", file=sys.stderr)
+        sys.exit(1)
+    if args.watch:
+        sys.exit(watch(instances, args.debounce, args.max_delay, summary=multi, workers=args.workers,
+                       poll_interval=args.poll_interval))
+    if not multi:
+        main()
+        sys.exit(0)
+    start = time.perf_counter()
+    results = check_all(instances, args.workers)
+    print_summary(results, time.perf_counter() - start)
+    sys.exit(1 if any(outcome.startswith("error") for _, outcome, _ in results) else 0)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Merge maintenance change feeds from many printers into one indexed store
+
+Sources are printer database files or JSON lines written by
+maintenance_feed.py ('-' reads stdin), optionally prefixed with ID= to name
+the printer. Only changes after the cursor stored for each printer are read.
+    maintenance_collector.py --store fleet.db /mnt/printers/*/yumi_maintenance.db
+    ssh pi@p12 python3 maintenance_feed.py --since $(maintenance_collector.py --store fleet.db --cursor p12) \
+        | maintenance_collector.py --store fleet.db p12=-
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+import maintenance_feed
+
+STORE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS printers
+       (printer TEXT PRIMARY KEY,
+        cursor INTEGER NOT NULL DEFAULT 0,
+        collected TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS tasks
+       (printer TEXT NOT NULL,
+        name TEXT NOT NULL,
+        last_done TEXT,
+        next_check TEXT,
+        first_done INTEGER,
+        usage_baseline TEXT,
+        PRIMARY KEY (printer, name))''',
+    "CREATE INDEX IF NOT EXISTS tasks_next_check ON tasks (next_check)",
+    '''CREATE TABLE IF NOT EXISTS events
+       (printer TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        ts TEXT NOT NULL,
+        task TEXT NOT NULL,
+        action TEXT NOT NULL,
+        usage TEXT,
+        PRIMARY KEY (printer, id))''',
+    "CREATE INDEX IF NOT EXISTS events_task ON events (task, action, ts)",
+    "CREATE INDEX IF NOT EXISTS events_printer ON events (printer, ts)",
+)
+
+TASK_UPSERT = '''INSERT INTO tasks (printer, name, last_done, next_check, first_done, usage_baseline)
+                 VALUES (?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(printer, name) DO UPDATE SET
+                   last_done=excluded.last_done,
+                   next_check=excluded.next_check,
+                   first_done=excluded.first_done,
+                   usage_baseline=excluded.usage_baseline'''
+TASK_DELETE = "DELETE FROM tasks WHERE printer=? AND name=?"
+EVENT_UPSERT = '''INSERT OR REPLACE INTO events (printer, id, ts, task, action, usage)
+                  VALUES (?, ?, ?, ?, ?, ?)'''
+CURSOR_UPSERT = '''INSERT INTO printers (printer, cursor, collected) VALUES (?, ?, ?)
+                   ON CONFLICT(printer) DO UPDATE SET cursor=excluded.cursor, collected=excluded.collected'''
+
+
+def open_store(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for sql in STORE_SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    return conn
+
+
+def get_cursor(store, printer):
+    row = store.execute("SELECT cursor FROM printers WHERE printer=?", (printer,)).fetchone()
+    return row[0] if row else 0
+
+
+def read_jsonl(f, since):
+    """Changes of a maintenance_feed.py dump, skipping those already collected"""
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record["seq"] > since:
+            yield record["seq"], record["table"], record["op"], record["key"], record["data"]
+
+
+def merge(store, printer, changes, batch=1000):
+    """Apply changes of one printer in a single transaction; returns how many were read"""
+    cursor = get_cursor(store, printer)
+    count = 0
+    pending = []
+
+    def apply():
+        # Keep the feed order: consecutive statements of the same kind go in one executemany
+        run_sql, run_rows = None, []
+        for sql, row in pending:
+            if sql != run_sql and run_rows:
+                store.executemany(run_sql, run_rows)
+                run_rows = []
+            run_sql = sql
+            run_rows.append(row)
+        if run_rows:
+            store.executemany(run_sql, run_rows)
+        pending.clear()
+
+    with store:
+        for seq, table, op, key, data in changes:
+            if table == "history" and op == "delete":
+                pending.append((TASK_DELETE, (printer, key)))
+            elif table == "history":
+                pending.append((TASK_UPSERT, (printer, data["name"], data["last_done"], data["next_check"],
+                                              data["first_done"], data["usage_baseline"])))
+            elif table == "events":
+                pending.append((EVENT_UPSERT, (printer, data["id"], data["ts"], data["task"],
+                                               data["action"], data["usage"])))
+            cursor = max(cursor, seq)
+            count += 1
+            if len(pending) >= batch:
+                apply()
+        apply()
+        store.execute(CURSOR_UPSERT, (printer, cursor, time.strftime("%Y-%m-%dT%H:%M:%S")))
+    return count
+
+
+def source_id(path):
+    """Printer id of a source: its folder for yumi_maintenance.db, else the file name
+
+    In a printer_data/database folder, as Klipper installs keep it, the id is
+    the folder holding printer_data (the host name for this machine's home)
+    and the instance folder, e.g. p12/printer_data or p12/printer_2_data."""
+    if os.path.basename(path) != "yumi_maintenance.db":
+        return os.path.splitext(os.path.basename(path))[0]
+    folder = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(folder) != "database":
+        return os.path.basename(folder)
+    instance = os.path.dirname(folder)
+    parent = os.path.dirname(instance)
+    host = socket.gethostname() if parent == os.path.expanduser("~") else os.path.basename(parent)
+    return f"{host}/{os.path.basename(instance)}" if host else os.path.basename(instance)
+
+
+def collect(store, source):
+    """Merge one source; returns (printer, number of changes)"""
+    printer, _, path = source.rpartition("=")
+    if path == "-":
+        if not printer:
+            raise ValueError("stdin needs a printer id, use ID=-")
+        return printer, merge(store, printer, read_jsonl(sys.stdin, get_cursor(store, printer)))
+    printer = printer or source_id(path)
+    since = get_cursor(store, printer)
+    if path.endswith(".db"):
+        conn = maintenance_feed.connect(path)
+        try:
+            return printer, merge(store, printer, maintenance_feed.iter_changes(conn, since))
+        finally:
+            conn.close()
+    with open(path, "r") as f:
+        return printer, merge(store, printer, read_jsonl(f, since))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--store", required=True, help="collector database")
+    parser.add_argument("--cursor", metavar="ID", help="print the last seq collected from a printer and exit")
+    parser.add_argument("sources", nargs="*", help="[ID=]printer.db, [ID=]feed.jsonl or ID=-")
+    args = parser.parse_args()
+    store = open_store(args.store)
+    if args.cursor:
+        print(get_cursor(store, args.cursor))
+        return 0
+    status = 0
+    total = 0
+    start = time.perf_counter()
+    for source in args.sources:
+        try:
+            printer, count = collect(store, source)
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            print(f"{source}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        total += count
+    print(f"{total} changes from {len(args.sources)} sources in {time.perf_counter() - start:.2f}s",
+          file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
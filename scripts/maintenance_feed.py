@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Stream yumi_maintenance changes after a cursor as JSON lines
+
+Every line is one change: {"seq", "table", "op", "key", "data"}. Pass the
+last seq received as --since on the next run to only get the delta, e.g.
+    ssh pi@printer python3 maintenance_feed.py --since 1234 > delta.jsonl
+"""
+import argparse
+import json
+import socket
+import sqlite3
+import sys
+
+DB_FILE = "/home/pi/printer_data/database/yumi_maintenance.db"
+
+
+def connect(db_file):
+    """Read-only connection, the printer keeps writing through its own"""
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, timeout=5.)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def iter_changes(conn, since=0, batch=1000):
+    """(seq, table, op, key, data) of every change after since, in seq order"""
+    while True:
+        rows = conn.execute("SELECT seq, tbl, op, key, data FROM maintenance_changes"
+                            " WHERE seq > ? ORDER BY seq LIMIT ?", (since, batch)).fetchall()
+        for seq, table, op, key, data in rows:
+            yield seq, table, op, key, json.loads(data) if data else None
+        if len(rows) < batch:
+            return
+        since = rows[-1][0]
+
+
+def export(conn, out, since=0, printer=None):
+    """Write changes after since as compact JSON lines; returns the last seq"""
+    last = since
+    for seq, table, op, key, data in iter_changes(conn, since):
+        record = {"seq": seq, "table": table, "op": op, "key": key, "data": data}
+        if printer:
+            record["printer"] = printer
+        out.write(json.dumps(record, separators=(',', ':')) + "\n")
+        last = seq
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--since", type=int, default=0, help="last seq already collected")
+    parser.add_argument("--printer", default=socket.gethostname(), help="id added to every line")
+    args = parser.parse_args()
+    try:
+        conn = connect(args.db)
+        export(conn, sys.stdout, args.since, args.printer)
+    except sqlite3.Error as e:
+        print(f"cannot read {args.db}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Forecast upcoming maintenance of one or many printers as JSON or iCalendar
+
+Reads yumi_maintenance.db files (printer ids as for maintenance_collector.py,
+or ID=path) and projects every task from its interval and the usage rate of
+the last --rate-days days, e.g.
+    maintenance_forecast.py --days 90 --format ical /mnt/printers/*/yumi_maintenance.db > fleet.ics
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import maintenance_feed
+import yumi_maintenance
+from maintenance_collector import source_id
+
+
+def load_printer(conn, now, rate_days):
+    """(tasks, totals, rates) of one printer database"""
+    tasks = []
+    for name, message, interval_days, limits, next_check, baseline in conn.execute(
+            "SELECT i.name, i.message, i.interval_days, i.limits, h.next_check, h.usage_baseline"
+            " FROM maintenance_intervals AS i JOIN maintenance_history AS h ON h.name = i.name"):
+        task = yumi_maintenance.MaintenanceTask(name, timedelta(days=interval_days), message, message,
+                                                limits=json.loads(limits) if limits else None)
+        task.next_check = datetime.fromisoformat(next_check) if next_check else now
+        task.usage_baseline = json.loads(baseline) if baseline else {}
+        tasks.append(task)
+    totals = dict(conn.execute("SELECT counter, value FROM maintenance_usage"))
+    window = (now - timedelta(days=rate_days)).isoformat(timespec='seconds')
+    rates = yumi_maintenance.usage_rates(
+        conn.execute(yumi_maintenance.RATE_SNAPSHOT, (window, window)).fetchone(), totals, now)
+    return tasks, totals, rates
+
+
+def write_json(out, due):
+    json.dump([{'printer': printer, 'task': task.name, 'message': task.message,
+                'due': when.isoformat(timespec='seconds'), 'trigger': trigger}
+               for when, printer, task, trigger in due], out, indent=1)
+    out.write("\n")
+
+
+def ical_text(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def write_ical(out, due, now):
+    stamp = now.strftime("%Y%m%dT%H%M%S")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Yumi-Lab//Yumi_Maintenance//EN"]
+    for when, printer, task, trigger in due:
+        lines += ["BEGIN:VEVENT",
+                  f"UID:{printer}-{task.name}-{when:%Y%m%d}@yumi_maintenance",
+                  f"DTSTAMP:{stamp}",
+                  f"DTSTART;VALUE=DATE:{when:%Y%m%d}",
+                  f"SUMMARY:{ical_text(f'{printer}: {task.message}')}",
+                  f"DESCRIPTION:{ical_text(f'Task {task.name}, due by {trigger}')}",
+                  "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    out.write("\r\n".join(lines) + "\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--days", type=float, default=90., help="forecast horizon")
+    parser.add_argument("--rate-days", type=float, default=30., help="usage rate window")
+    parser.add_argument("--format", choices=("json", "ical"), default="json")
+    parser.add_argument("sources", nargs="*", default=[maintenance_feed.DB_FILE], help="[ID=]printer.db")
+    args = parser.parse_args()
+    now = datetime.now()
+    horizon = timedelta(days=args.days)
+    status = 0
+    due = []
+    for source in args.sources:
+        printer, _, path = source.rpartition("=")
+        printer = printer or source_id(path)
+        try:
+            conn = maintenance_feed.connect(path)
+            try:
+                tasks, totals, rates = load_printer(conn, now, args.rate_days)
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"{source}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        due += [(when, printer, task, trigger)
+                for when, task, trigger in yumi_maintenance.forecast(tasks, now, totals, rates, horizon)]
+    due.sort(key=lambda row: (row[0], row[1]))
+    if args.format == "ical":
+        write_ical(sys.stdout, due, now)
+    else:
+        write_json(sys.stdout, due)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,317 @@
+import json
 import logging
 import os
-from io import BytesIO
-import qrcode
-from PIL import Image
+import threading
+from collections import OrderedDict
 import gi
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, Gdk, GdkPixbuf
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
 
+VISUAL_SIZE = 200
+QR_FILL = b"\x80\x80\x80"  # grey modules
+QR_BACK = b"\x00\x00\x00"  # on black
+QR_PRERENDER_MAX = 16
+PIXBUF_CACHE_BYTES = 8 * 1024 * 1024
+MAINTENANCE_STYLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "styles", "maintenance")
+GUIDE_URLS_FILE = os.path.join(MAINTENANCE_STYLE, "guide_urls.txt")
 
-def generate_qrcode_pixbuf(url):
+_qr_prerender_started = False
+_css_installed = False
+_view = None
+
+
+class PixbufCache:
+    """Process-wide LRU of decoded pixbufs bounded by their pixel memory"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_file(self, path, width, height):
+        """Image file scaled to fit width x height, reloaded when its mtime changes"""
+        mtime = os.stat(path).st_mtime_ns
+        return self._get(("file", path, width, height), mtime,
+                         lambda: GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height, True))
+
+    def get_generated(self, key, factory):
+        """Pixbuf built by factory(), cached under key"""
+        return self._get(("generated",) + key, None, factory)
+
+    def _get(self, key, version, factory):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        pixbuf = factory()
+        size = pixbuf.get_rowstride() * pixbuf.get_height()
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (version, pixbuf, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return pixbuf
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+pixbuf_cache = PixbufCache(PIXBUF_CACHE_BYTES)
+
+
+def render_qrcode_pixbuf(url, size=VISUAL_SIZE):
+    """Draw the QR matrix straight into an RGB pixbuf of size x size"""
+    # Imported on first use: it is slow to load from an SD card and most
+    # screens never show a QR code
+    import qrcode
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=6,
+        box_size=1,
         border=2,
     )
     qr.add_data(url)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="grey", back_color="black")
+    matrix = qr.get_matrix()
+    modules = len(matrix)
+    # Whole pixels per module keep the code sharp, the remainder is padding
+    scale = max(1, size // modules)
+    pad = max(0, (size - scale * modules) // 2)
+    blank_row = QR_BACK * size
+    rows = {}
+    data = [blank_row] * pad
+    for row in matrix:
+        key = tuple(row)
+        line = rows.get(key)
+        if line is None:
+            line = (QR_BACK * pad
+                    + b"".join((QR_FILL if cell else QR_BACK) * scale for cell in row)
+                    + QR_BACK * (size - pad - scale * modules))
+            rows[key] = line
+        data.extend([line] * scale)
+    data.extend([blank_row] * (size - len(data)))
+    return GdkPixbuf.Pixbuf.new_from_bytes(
+        GLib.Bytes.new(b"".join(data[:size])), GdkPixbuf.Colorspace.RGB, False, 8, size, size, size * 3)
+
 
-    buffer = BytesIO()
+def get_qrcode_pixbuf(url, size=VISUAL_SIZE):
+    """Cached render_qrcode_pixbuf"""
+    return pixbuf_cache.get_generated(("qrcode", url, size), lambda: render_qrcode_pixbuf(url, size))
+
+
+def _prerender_guides():
     try:
-        img.save(buffer, format='PNG')
-    except Exception:
-        img.save(buffer)
+        with open(GUIDE_URLS_FILE) as f:
+            urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except OSError:
+        return
+    for url in urls[:QR_PRERENDER_MAX]:
+        try:
+            get_qrcode_pixbuf(url)
+        except Exception as e:
+            logging.error(f"Failed to pre-render QR for {url}: {e}")
+
+
+def start_qrcode_prerender():
+    """Render the known guide URLs in the background, once per process"""
+    global _qr_prerender_started
+    if _qr_prerender_started:
+        return
+    _qr_prerender_started = True
+    threading.Thread(target=_prerender_guides, name="prompt-qr-prerender", daemon=True).start()
+
+
+def _warm_maintenance_styles():
+    """Decode the maintenance images one per idle callback so startup is not delayed"""
+    # The QR stack is only imported there if guide URLs are configured
+    start_qrcode_prerender()
+    try:
+        paths = sorted(os.path.join(MAINTENANCE_STYLE, name) for name in os.listdir(MAINTENANCE_STYLE)
+                       if name.lower().endswith(".png"))
+    except OSError:
+        return False
+
+    def warm_next():
+        if not paths:
+            logging.info(f"Maintenance images warmed: {pixbuf_cache.stats()}")
+            return False
+        path = paths.pop(0)
+        try:
+            pixbuf_cache.get_file(path, VISUAL_SIZE, VISUAL_SIZE)
+        except Exception as e:
+            logging.error(f"Failed to warm {path}: {e}")
+        return True
+
+    GLib.idle_add(warm_next, priority=GLib.PRIORITY_LOW)
+    return False
+
+
+GLib.timeout_add_seconds(5, _warm_maintenance_styles)
+
+
+class PromptView:
+    """Dialog body built once per process and refilled in place for every prompt"""
+    VISUAL_SLOTS = 2
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.gtk = screen.gtk
+        self.owner = None
+        self.visible_frames = 0
+
+        self.title = Gtk.Label(wrap=True)
+        self.title.set_name("prompt-title")
+        self.title.set_halign(Gtk.Align.CENTER)
+        self.title.set_hexpand(True)
+
+        close = self.gtk.Button("cancel", scale=self.gtk.bsidescale)
+        close.set_hexpand(False)
+        close.set_vexpand(False)
+        close.connect("clicked", self._close_clicked)
+
+        self.label = Gtk.Label(wrap=True)
+        self.label.set_name("prompt-text")
+        self.label.set_line_wrap(True)
+        self.label.set_line_wrap_mode(Gtk.WrapMode.WORD)
+        self.label.set_margin_top(10)
+        self.label.set_margin_bottom(10)
+        self.label.set_margin_start(10)
+        self.label.set_margin_end(10)
+
+        # Optional parts are hidden by hand, show_all() from the dialog must not reveal them
+        self.visuals_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=15)
+        self.visuals_box.set_valign(Gtk.Align.CENTER)
+        self.visuals_box.set_halign(Gtk.Align.END)
+        self.visuals_box.set_margin_end(15)
+        self.visuals_box.set_no_show_all(True)
+        self.images = []
+        self.frames = []
+        for _ in range(self.VISUAL_SLOTS):
+            image = Gtk.Image()
+            frame = Gtk.Frame()
+            frame.get_style_context().add_class("visual-frame")
+            align = Gtk.Alignment.new(0.5, 0.5, 1, 1)
+            align.set_padding(10, 10, 10, 10)
+            align.add(image)
+            frame.add(align)
+            frame.set_no_show_all(True)
+            align.show_all()
+            self.visuals_box.pack_start(frame, False, False, 0)
+            self.images.append(image)
+            self.frames.append(frame)
+
+        text_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        text_box.pack_start(self.label, True, True, 0)
+        self.content_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=20)
+        self.content_box.set_valign(Gtk.Align.CENTER)
+        self.content_box.get_style_context().add_class("content-box")
+        self.content_box.pack_start(text_box, True, True, 0)
+        self.content_box.pack_end(self.visuals_box, False, False, 0)
+
+        self.button_area = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        align = Gtk.Alignment.new(0.5, 0.5, 1, 1)
+        align.add(self.content_box)
+        scroll_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        scroll_box.pack_start(self.button_area, False, False, 0)
+        scroll_box.pack_start(align, True, True, 0)
+
+        scroll = self.gtk.ScrolledWindow(steppers=False)
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scroll.add(scroll_box)
+
+        self.root = Gtk.Grid()
+        if not screen.windowed:
+            self.root.attach(self.title, 0, 0, 1, 1)
+            self.root.attach(close, 1, 0, 1, 1)
+        self.root.attach(scroll, 0, 1, 2, 1)
+        self.root.connect("destroy", self._destroyed)
+
+    def _close_clicked(self, widget):
+        if self.owner is not None:
+            self.owner.close()
+
+    def _destroyed(self, widget):
+        global _view
+        if _view is self:
+            _view = None
+
+    def update(self, prompt):
+        """Load the prompt's title, text, visuals and body buttons into the widgets"""
+        self.owner = prompt
+        self.title.set_label(prompt.header)
+        self.label.set_label(prompt.text.strip())
+
+        pixbufs = []
+        try:
+            if prompt.image_path and os.path.isfile(prompt.image_path):
+                pixbufs.append(pixbuf_cache.get_file(prompt.image_path, VISUAL_SIZE, VISUAL_SIZE))
+            if prompt.qrcode_url:
+                pixbufs.append(get_qrcode_pixbuf(prompt.qrcode_url))
+        except Exception as e:
+            logging.error(f"Failed to load image/QR: {e}")
+        logging.debug(f"Pixbuf cache: {pixbuf_cache.stats()}")
+        for i, image in enumerate(self.images):
+            if i < len(pixbufs):
+                image.set_from_pixbuf(pixbufs[i])
+            else:
+                image.clear()
+        self.visible_frames = len(pixbufs)
+        self.label.set_halign(Gtk.Align.FILL if pixbufs else Gtk.Align.CENTER)
+        self.content_box.set_hexpand(not pixbufs)
+        self.content_box.set_vexpand(not pixbufs)
+
+        for child in self.button_area.get_children():
+            child.destroy()
+        for item in prompt.body:
+            if isinstance(item, list):
+                group = Gtk.FlowBox(
+                    selection_mode=Gtk.SelectionMode.NONE,
+                    orientation=Gtk.Orientation.HORIZONTAL,
+                )
+                for spec in item:
+                    group.add(self._button(*spec))
+                group.set_max_children_per_line(min(4, len(item)))
+                group.set_min_children_per_line(min(4, len(item)))
+                self.button_area.add(group)
+            else:
+                self.button_area.add(self._button(*item))
 
-    buffer.seek(0)
-    loader = GdkPixbuf.PixbufLoader.new_with_type('png')
-    loader.write(buffer.read())
-    loader.close()
-    return loader.get_pixbuf()
+    def _button(self, name, gcode, style):
+        button = self.gtk.Button(image_name=None, label=name, style=f'dialog-{style}')
+        button.connect("clicked", self.screen._send_action, "printer.gcode.script", {'script': gcode})
+        return button
+
+    def apply_visibility(self):
+        """Run after the dialog's show_all()"""
+        for i, frame in enumerate(self.frames):
+            frame.set_visible(i < self.visible_frames)
+        self.visuals_box.set_visible(self.visible_frames > 0)
+
+    def detach(self):
+        """Take the body out of its dialog so destroying the dialog keeps it alive"""
+        parent = self.root.get_parent()
+        if parent is not None:
+            parent.remove(self.root)
+        self.owner = None
+
+
+def get_prompt_view(screen):
+    global _view
+    if _view is None or _view.screen is not screen:
+        _view = PromptView(screen)
+    return _view
 
 
 class Prompt:
@@ -42,15 +323,20 @@ class Prompt:
         self.buttons = []
         self.id = 1
         self.prompt = None
-        self.scroll_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.body = []
         self.groups = []
 
         self.image_path = None
         self.qrcode_url = None
 
         self._init_css()
+        start_qrcode_prerender()
 
     def _init_css(self):
+        global _css_installed
+        if _css_installed:
+            return
+        _css_installed = True
         css = b"""
         #prompt-title {
             font-size: 30px;
@@ -86,82 +372,121 @@ class Prompt:
 
     def decode(self, data):
         logging.info(f'{data}')
-        if data.startswith('prompt_begin'):
-            # Rcupre le texte brut depuis la macro
-            raw_header = data.replace('prompt_begin', '').strip()
-            # Applique la traduction au texte dynamique
-            self.header = _(raw_header) if raw_header else ""
-            self.window_title = self.header
-            self.text = ""
-            self.buttons = []
-            self.image_path = None
-            self.qrcode_url = None
-            return
-        elif data.startswith('prompt_text'):
-            # Rcupre le texte brut depuis la macro
-            raw_text = data.replace('prompt_text ', '')
-            # Applique la traduction au texte dynamique
-            self.text += _(raw_text) + "\n" if raw_text else ""
-            return
-        elif data.startswith('prompt_image '):
-            self.image_path = data.replace('prompt_image ', '').strip()
-            return
-        elif data.startswith('prompt_qrcode '):
-            self.qrcode_url = data.replace('prompt_qrcode ', '').strip()
+        action, _sep, arg = data.partition(' ')
+        handler = self.ACTIONS.get(action)
+        if handler is None:
+            logging.debug(f'Unknown option {data}')
             return
-        elif data.startswith('prompt_button '):
-            data = data.replace('prompt_button ', '')
-            params = data.split('|')
-            if len(params) == 1:
-                params.append(self.text)
-            if len(params) > 3:
-                logging.error('Unexpected number of parameters on the button')
-                return
-            
-            # Traduction du nom du bouton dynamique
-            params[0] = _(params[0]) if params[0] else params[0]
+        handler(self, arg)
+
+    def _begin(self, arg):
+        # Rcupre le texte brut depuis la macro
+        raw_header = arg.strip()
+        # Applique la traduction au texte dynamique
+        self.header = _(raw_header) if raw_header else ""
+        self.window_title = self.header
+        self.text = ""
+        self.buttons = []
+        self.body = []
+        self.groups = []
+        self.image_path = None
+        self.qrcode_url = None
+
+    def _text(self, raw_text):
+        # Applique la traduction au texte dynamique
+        self.text += _(raw_text) + "\n" if raw_text else ""
+
+    def _image(self, arg):
+        self.image_path = arg.strip()
+
+    def _qrcode(self, arg):
+        self.qrcode_url = arg.strip()
+
+    def _parse_button(self, params):
+        if len(params) == 1:
+            params.append(self.text)
+        if len(params) > 3:
+            logging.error('Unexpected number of parameters on the button')
+            return None
+        # Traduction du nom du bouton dynamique
+        params[0] = _(params[0]) if params[0] else params[0]
+        return params
+
+    def _button(self, arg):
+        params = self._parse_button(arg.split('|'))
+        if params:
             self.set_button(*params)
-            return
-        elif data.startswith('prompt_footer_button '):
-            data = data.replace('prompt_footer_button ', '')
-            params = data.split('|')
-            if len(params) == 1:
-                params.append(self.text)
-            if len(params) > 3:
-                logging.error('Unexpected number of parameters on the button')
-                return
-            
-            # Traduction du nom du bouton dynamique
-            params[0] = _(params[0]) if params[0] else params[0]
+
+    def _footer_button(self, arg):
+        params = self._parse_button(arg.split('|'))
+        if params:
             self.set_footer_button(*params)
+
+    def _show(self, arg):
+        if not self.prompt:
+            self.show()
+
+    def _end(self, arg):
+        self.end()
+
+    def _group_start(self, arg):
+        self.groups.append([])
+
+    def _group_end(self, arg):
+        if self.groups:
+            self.body.append(self.groups.pop())
+
+    def _batch(self, arg):
+        """Whole prompt body in one JSON message, sent after prompt_begin"""
+        try:
+            batch = json.loads(arg)
+        except ValueError as e:
+            logging.error(f'Invalid prompt_batch payload: {e}')
             return
-        elif data == 'prompt_show':
-            if not self.prompt:
-                self.show()
-            return
-        elif data == 'prompt_end':
-            self.end()
-        elif data == 'prompt_button_group_start':
-            self.groups.append(Gtk.FlowBox(
-                selection_mode=Gtk.SelectionMode.NONE,
-                orientation=Gtk.Orientation.HORIZONTAL,
-            ))
-        elif data == 'prompt_button_group_end':
-            if self.groups:
-                self.scroll_box.add(self.groups.pop())
-        else:
-            logging.debug(f'Unknown option {data}')
+        for line in batch.get('text', ()):
+            self._text(line)
+        if batch.get('image'):
+            self._image(batch['image'])
+        if batch.get('qrcode'):
+            self._qrcode(batch['qrcode'])
+        # Buttons come as [name, gcode, style] lists, a list of those is a group
+        for item in batch.get('buttons', ()):
+            group = item if item and isinstance(item[0], list) else [item]
+            if group is item:
+                self._group_start('')
+            for params in group:
+                params = self._parse_button(list(params))
+                if params:
+                    self.set_button(*params)
+            if group is item:
+                self._group_end('')
+        for params in batch.get('footer', ()):
+            params = self._parse_button(list(params))
+            if params:
+                self.set_footer_button(*params)
+        if batch.get('show', True):
+            self._show('')
+
+    ACTIONS = {
+        'prompt_begin': _begin,
+        'prompt_text': _text,
+        'prompt_image': _image,
+        'prompt_qrcode': _qrcode,
+        'prompt_button': _button,
+        'prompt_footer_button': _footer_button,
+        'prompt_show': _show,
+        'prompt_end': _end,
+        'prompt_button_group_start': _group_start,
+        'prompt_button_group_end': _group_end,
+        'prompt_batch': _batch,
+    }
 
     def set_button(self, name, gcode, style='default'):
-        button = self.gtk.Button(image_name=None, label=name, style=f'dialog-{style}')
-        button.connect("clicked", self.screen._send_action, "printer.gcode.script", {'script': gcode})
+        # Widgets are only built in show(), by the retained view
         if self.groups:
-            self.groups[-1].add(button)
-            max_childs = len(self.groups[-1].get_children())
-            self.groups[-1].set_max_children_per_line(min(4, max_childs))
-            self.groups[-1].set_min_children_per_line(min(4, max_childs))
+            self.groups[-1].append((name, gcode, style))
         else:
-            self.scroll_box.add(button)
+            self.body.append((name, gcode, style))
 
     def set_footer_button(self, name, gcode, style='default'):
         self.buttons.append(
@@ -172,92 +497,16 @@ class Prompt:
     def show(self):
         logging.info(f'Prompt {self.header} {self.text} {self.buttons}')
 
-        title = Gtk.Label(label=self.header, wrap=True)
-        title.set_name("prompt-title")
-        title.set_halign(Gtk.Align.CENTER)
-        title.set_hexpand(True)
-
-        close = self.gtk.Button("cancel", scale=self.gtk.bsidescale)
-        close.set_hexpand(False)
-        close.set_vexpand(False)
-        close.connect("clicked", self.close)
-
-        visual_elements = []
-        
-        try:
-            if self.image_path and os.path.isfile(self.image_path):
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(self.image_path, 200, 200, True)
-                visual_elements.append(Gtk.Image.new_from_pixbuf(pixbuf))
-            if self.qrcode_url:
-                pixbuf = generate_qrcode_pixbuf(self.qrcode_url)
-                pixbuf = pixbuf.scale_simple(200, 200, GdkPixbuf.InterpType.BILINEAR)
-                visual_elements.append(Gtk.Image.new_from_pixbuf(pixbuf))
-        except Exception as e:
-            logging.error(f"Failed to load image/QR: {e}")
-
-        label = Gtk.Label(label=self.text.strip(), wrap=True)
-        label.set_name("prompt-text")
-        label.set_line_wrap(True)
-        label.set_line_wrap_mode(Gtk.WrapMode.WORD)
-        label.set_margin_top(10)
-        label.set_margin_bottom(10)
-        label.set_margin_start(10)
-        label.set_margin_end(10)
-
-        if visual_elements:
-            visuals_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=15)
-            visuals_box.set_valign(Gtk.Align.CENTER)
-            visuals_box.set_halign(Gtk.Align.END)
-            visuals_box.set_margin_end(15)
-            
-            for element in visual_elements:
-                frame = Gtk.Frame()
-                frame.get_style_context().add_class("visual-frame")
-                align = Gtk.Alignment.new(0.5, 0.5, 1, 1)
-                align.set_padding(10, 10, 10, 10)
-                align.add(element)
-                frame.add(align)
-                visuals_box.pack_start(frame, False, False, 0)
-
-            content_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=20)
-            content_box.set_valign(Gtk.Align.CENTER)
-            content_box.get_style_context().add_class("content-box")
-            
-            text_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-            text_box.pack_start(label, True, True, 0)
-            content_box.pack_start(text_box, True, True, 0)
-            
-            content_box.pack_end(visuals_box, False, False, 0)
-        else:
-            content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-            label.set_halign(Gtk.Align.CENTER)
-            label.set_valign(Gtk.Align.CENTER)
-            content_box.set_valign(Gtk.Align.CENTER)
-            content_box.set_hexpand(True)
-            content_box.set_vexpand(True)
-            content_box.pack_start(label, True, True, 20)
-
-        align = Gtk.Alignment.new(0.5, 0.5, 1, 1)
-        align.add(content_box)
-
-        self.scroll_box.pack_start(align, True, True, 0)
-
-        scroll = self.gtk.ScrolledWindow(steppers=False)
-        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        scroll.add(self.scroll_box)
-
-        content = Gtk.Grid()
-        if not self.screen.windowed:
-            content.attach(title, 0, 0, 1, 1)
-            content.attach(close, 1, 0, 1, 1)
-        content.attach(scroll, 0, 1, 2, 1)
-
+        view = get_prompt_view(self.screen)
+        view.detach()
+        view.update(self)
         self.prompt = self.gtk.Dialog(
             self.window_title,
             self.buttons,
-            content,
+            view.root,
             self.response,
         )
+        view.apply_visibility()
         self.prompt.connect("key-press-event", self._key_press_event)
         self.prompt.connect("delete-event", self.close)
         self.screen.screensaver.close()
@@ -273,6 +522,8 @@ class Prompt:
 
     def end(self):
         if self.prompt is not None:
+            if _view is not None and _view.owner is self:
+                _view.detach()
             self.gtk.remove_dialog(self.prompt)
         self.prompt = None
         self.screen.prompt = None
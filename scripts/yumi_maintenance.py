@@ -1,260 +1,1713 @@
-import sqlite3
+import bisect
+import collections
+import configparser
+import heapq
+import itertools
+import json
+import logging
 import os
+import queue
+import re
+import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HISTORY_TABLE = '''CREATE TABLE IF NOT EXISTS maintenance_history
+                   (name TEXT PRIMARY KEY,
+                    last_done TEXT,
+                    next_check TEXT,
+                    first_done INTEGER DEFAULT 0,
+                    usage_baseline TEXT)'''
+
+HISTORY_JSON = '''json_object('name', NEW.name, 'last_done', NEW.last_done, 'next_check', NEW.next_check,
+                              'first_done', NEW.first_done, 'usage_baseline', NEW.usage_baseline)'''
+EVENT_JSON = '''json_object('id', NEW.id, 'ts', NEW.ts, 'task', NEW.task, 'action', NEW.action,
+                            'usage', NEW.usage)'''
+
+USAGE_TABLE = '''CREATE TABLE IF NOT EXISTS maintenance_usage
+                 (counter TEXT PRIMARY KEY,
+                  value REAL NOT NULL)'''
+# Every counter at the first checkpoint of each day, usage rates are measured from them
+USAGE_SNAPSHOT_TABLE = '''CREATE TABLE IF NOT EXISTS maintenance_usage_snapshots
+                          (day TEXT PRIMARY KEY,
+                           ts TEXT NOT NULL,
+                           usage TEXT NOT NULL)'''
+
+# Tables nothing reads while the config loads, created once klippy is ready.
+# maintenance_changes numbers each history/event row change (seq) for the
+# change feed read by maintenance_feed.py.
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS maintenance_events
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT NOT NULL,
+        task TEXT NOT NULL,
+        action TEXT NOT NULL,
+        usage TEXT)''',
+    "CREATE INDEX IF NOT EXISTS maintenance_events_task ON maintenance_events (task, ts)",
+    "CREATE INDEX IF NOT EXISTS maintenance_events_action ON maintenance_events (action, ts)",
+    "CREATE INDEX IF NOT EXISTS maintenance_events_ts ON maintenance_events (ts)",
+    '''CREATE TABLE IF NOT EXISTS maintenance_event_totals
+       (period TEXT NOT NULL,
+        task TEXT NOT NULL,
+        action TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (period, task, action))''',
+    '''CREATE TABLE IF NOT EXISTS maintenance_changes
+       (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        key TEXT NOT NULL,
+        op TEXT NOT NULL,
+        data TEXT)''',
+    "CREATE INDEX IF NOT EXISTS maintenance_changes_key ON maintenance_changes (tbl, key)",
+    # Task definitions as last configured, so maintenance_forecast.py can run without printer.cfg
+    '''CREATE TABLE IF NOT EXISTS maintenance_intervals
+       (name TEXT PRIMARY KEY,
+        message TEXT NOT NULL,
+        interval_days REAL NOT NULL,
+        limits TEXT)''',
+    f'''CREATE TRIGGER IF NOT EXISTS maintenance_history_insert AFTER INSERT ON maintenance_history
+        BEGIN
+          INSERT INTO maintenance_changes (tbl, key, op, data)
+          VALUES ('history', NEW.name, 'upsert', {HISTORY_JSON});
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS maintenance_history_update AFTER UPDATE ON maintenance_history
+        WHEN OLD.last_done IS NOT NEW.last_done OR OLD.next_check IS NOT NEW.next_check
+          OR OLD.first_done IS NOT NEW.first_done OR OLD.usage_baseline IS NOT NEW.usage_baseline
+        BEGIN
+          INSERT INTO maintenance_changes (tbl, key, op, data)
+          VALUES ('history', NEW.name, 'upsert', {HISTORY_JSON});
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS maintenance_history_delete AFTER DELETE ON maintenance_history
+       BEGIN
+         INSERT INTO maintenance_changes (tbl, key, op, data) VALUES ('history', OLD.name, 'delete', NULL);
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS maintenance_events_insert AFTER INSERT ON maintenance_events
+        BEGIN
+          INSERT INTO maintenance_changes (tbl, key, op, data)
+          VALUES ('events', NEW.id, 'insert', {EVENT_JSON});
+        END''',
+)
+
+# Rows written before the change feed existed, only while it is still empty
+CHANGES_BACKFILL = (
+    f'''INSERT INTO maintenance_changes (tbl, key, op, data)
+        SELECT 'history', NEW.name, 'upsert', {HISTORY_JSON} FROM maintenance_history AS NEW
+        WHERE NOT EXISTS (SELECT 1 FROM maintenance_changes) ORDER BY NEW.name''',
+    f'''INSERT INTO maintenance_changes (tbl, key, op, data)
+        SELECT 'events', NEW.id, 'insert', {EVENT_JSON} FROM maintenance_events AS NEW
+        WHERE NOT EXISTS (SELECT 1 FROM maintenance_changes WHERE tbl='events') ORDER BY NEW.id''',
+)
+
+# Only the latest change of a history row is needed to rebuild it, and
+# changes of purged events go with them
+CHANGES_COMPACT = '''DELETE FROM maintenance_changes
+                     WHERE (tbl='history' AND seq < (SELECT MAX(c.seq) FROM maintenance_changes AS c
+                                                     WHERE c.tbl='history' AND c.key=maintenance_changes.key))
+                        OR (tbl='events' AND json_extract(data, '$.ts') < ?)'''
+
+HISTORY_UPSERT = '''INSERT INTO maintenance_history (name, last_done, next_check, first_done, usage_baseline)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                      last_done=excluded.last_done,
+                      next_check=excluded.next_check,
+                      first_done=excluded.first_done,
+                      usage_baseline=excluded.usage_baseline'''
+
+EVENT_INSERT = '''INSERT INTO maintenance_events (ts, task, action, usage) VALUES (?, ?, ?, ?)'''
+
+# Fold events older than the cutoff into monthly counts, then drop them
+EVENT_FOLD = '''INSERT INTO maintenance_event_totals (period, task, action, count)
+                SELECT substr(ts, 1, 7), task, action, COUNT(*) FROM maintenance_events
+                WHERE ts < ? GROUP BY substr(ts, 1, 7), task, action
+                ON CONFLICT(period, task, action) DO UPDATE SET count=count + excluded.count'''
+EVENT_PURGE = '''DELETE FROM maintenance_events WHERE ts < ?'''
+
+INTERVAL_INSERT = '''INSERT INTO maintenance_intervals (name, message, interval_days, limits)
+                     VALUES (?, ?, ?, ?)'''
+
+# Oldest usage snapshot in the rate window, see usage_rates. Events carry one
+# too, which covers the days before maintenance_usage_snapshots existed.
+RATE_SNAPSHOT = '''SELECT ts, usage FROM (
+                     SELECT ts, usage FROM maintenance_usage_snapshots WHERE ts >= ?
+                     UNION ALL
+                     SELECT ts, usage FROM maintenance_events WHERE ts >= ? AND usage IS NOT NULL)
+                   ORDER BY ts LIMIT 1'''
+
+USAGE_UPSERT = '''INSERT INTO maintenance_usage (counter, value) VALUES (?, ?)
+                  ON CONFLICT(counter) DO UPDATE SET value=excluded.value'''
+USAGE_SNAPSHOT_INSERT = '''INSERT OR IGNORE INTO maintenance_usage_snapshots (day, ts, usage) VALUES (?, ?, ?)'''
+USAGE_SNAPSHOT_PURGE = '''DELETE FROM maintenance_usage_snapshots WHERE ts < ?'''
+
+# Task option -> (summed usage counters, counter units per option unit)
+USAGE_INTERVALS = {
+    'interval_print_hours': (('print_seconds',), 3600.),
+    'interval_filament_mm': (('filament_mm',), 1.),
+    'interval_xy_m': (('odometer_x', 'odometer_y'), 1000.),
+    'interval_z_m': (('odometer_z',), 1000.),
+}
+
+# What makes a forecast occurrence due: the calendar or one usage interval
+FORECAST_TRIGGERS = ('calendar',) + tuple(option[len('interval_'):] for option in USAGE_INTERVALS)
+
+# Used when Klipper's start arguments do not name the config file, see instance_files
+DB_FILE = "/home/pi/printer_data/database/yumi_maintenance.db"
+LOG_FILE = "/home/pi/printer_data/logs/yumi_maintenance.log"
+TASK_SECTION = "yumi_maintenance_task"
+TASKS_FILE = "/home/pi/printer_data/config/Yumi_Maintenance.cfg"
+# Written by install/build_assets.py next to the display-size images
+ASSET_MANIFEST = "/home/pi/KlipperScreen/styles/maintenance/manifest.json"
+TASK_NAME_R = re.compile(r'^[A-Za-z0-9_]+$')
+# Placeholder replaced by the component name in templated tasks
+COMPONENT = "{component}"
+
+# Used when neither printer.cfg nor the tasks file declares any task
+DEFAULT_TASKS = """
+[yumi_maintenance_task oil_xy_axes]
+interval_days: 30
+interval_xy_m: 50000
+message: Lubricate X/Y axes
+prompt: Code: A00 - MAINTENANCE: Lubricate X/Y axes (Monthly) Scan for complete guide
+image: /home/pi/KlipperScreen/styles/maintenance/xyz.png
+priority: 1
+first: True
+
+[yumi_maintenance_task oil_z_axes]
+interval_days: 90
+interval_z_m: 500
+message: Lubricate Z axes
+prompt: Code: A00 - MAINTENANCE: Lubricate Z axes (Monthly) Scan for complete guide
+image: /home/pi/KlipperScreen/styles/maintenance/xyz.png
+priority: 1
+first: True
+
+[yumi_maintenance_task clean_nozzle]
+interval_days: 14
+interval_print_hours: 50
+interval_filament_mm: 100000
+message: Clean nozzle
+prompt: Code: E00 - MAINTENANCE: Clean nozzle (Weekly) Scan for complete guide
+qr_message: Cleaning guide
+image: /home/pi/KlipperScreen/styles/maintenance/nozzle.png
+
+[yumi_maintenance_task clean_plate]
+interval_days: 7
+interval_print_hours: 25
+message: Clean Plate
+prompt: Code: P00 - MAINTENANCE: Clean Plate (Weekly) Scan for complete guide
+qr_message: Cleaning guide
+image: /home/pi/KlipperScreen/styles/maintenance/plate.png
+
+[yumi_maintenance_task belt_tension]
+interval_days: 60
+interval_xy_m: 100000
+message: Belt Tension
+prompt: Code: A01 - MAINTENANCE: Belt Tension (Weekly) Scan for complete guide
+qr_message: Cleaning guide
+image: /home/pi/KlipperScreen/styles/maintenance/belt_tension.png
+
+[yumi_maintenance_task clean_fan]
+interval_days: 14
+interval_print_hours: 100
+message: Clean Fan
+prompt: Code: A01 - MAINTENANCE: Clean Fan (Weekly) Scan for complete guide
+qr_message: Cleaning guide
+image: /home/pi/KlipperScreen/styles/maintenance/clean_fan.png
+"""
+
+
+def usage_json(totals):
+    return json.dumps({k: round(v, 1) for k, v in totals.items()}, separators=(',', ':'))
+
+
+def event_row(task_name, action, totals, now=None):
+    now = now or datetime.now()
+    return (now.isoformat(timespec='seconds'), task_name, action, usage_json(totals))
+
+
+def sql_where(conditions):
+    """WHERE clause and parameters ANDing (condition, value) pairs"""
+    if not conditions:
+        return "", []
+    return " WHERE " + " AND ".join(c for c, _ in conditions), [v for _, v in conditions]
+
+
+def history_row(task):
+    return (task.name,
+            task.last_done.isoformat() if task.last_done else None,
+            task.next_check.isoformat(),
+            int(task.first_done),
+            json.dumps(task.usage_baseline))
+
+
+def action_line(action):
+    """Host line for a '// action:' command, as RESPOND TYPE=command would send it"""
+    return "// action:" + action
+
+
+def prompt_field(value):
+    """One prompt value on one host line"""
+    return " ".join(str(value).splitlines())
+
+
+def button_field(value):
+    """Button values are '|' separated on the wire"""
+    return prompt_field(value).replace("|", "/")
+
+
+def prompt_spec(tasks):
+    """Title, text, image and buttons of the dialog for one or several due tasks"""
+    tasks = sorted(tasks, key=lambda t: t.priority)
+    names = ",".join(t.name for t in tasks)
+    spec = {
+        'title': "Maintenance Required",
+        'text': [t.prompt for t in tasks],
+        'image': tasks[0].image,
+        'buttons': [],
+        'footer': [["Not Now", f"MAINTENANCE_POSTPONE TASK={names}"],
+                   ["Confirm", f"MAINTENANCE_CONFIRM TASK={names}"]],
+    }
+    if len(tasks) > 1:
+        # One confirm button per task, the footer then acts on all of them
+        spec['buttons'] = [[t.message, f"MAINTENANCE_CONFIRM TASK={t.name}", "primary"] for t in tasks]
+        spec['footer'][1][0] = "Confirm All"
+    return spec
+
+
+def legacy_prompt_lines(spec):
+    """One action per line, understood by any prompt widget"""
+    lines = [action_line(f"prompt_begin {prompt_field(spec['title'])}")]
+    lines += [action_line(f"prompt_text {prompt_field(text)}") for text in spec['text']]
+    if spec['image']:
+        lines.append(action_line(f"prompt_image {prompt_field(spec['image'])}"))
+    lines += [action_line("prompt_button " + "|".join(map(button_field, button)))
+              for button in spec['buttons']]
+    lines += [action_line("prompt_footer_button " + "|".join(map(button_field, button)))
+              for button in spec['footer']]
+    lines.append(action_line("prompt_close_on_click"))
+    lines.append(action_line("prompt_show"))
+    return lines
+
+
+def batch_prompt_lines(spec):
+    """prompt_begin (which makes KlipperScreen create the widget) plus one prompt_batch"""
+    body = {key: spec[key] for key in ('text', 'image', 'buttons', 'footer') if spec[key]}
+    body['show'] = True
+    return [action_line(f"prompt_begin {prompt_field(spec['title'])}"),
+            action_line("prompt_batch " + json.dumps(body, separators=(',', ':')))]
+
+
+def compile_prompt(tasks, batch=True):
+    """Host lines of the dialog for tasks, ready to be sent as they are"""
+    spec = prompt_spec(tasks)
+    if batch:
+        return tuple(batch_prompt_lines(spec))
+    return tuple(legacy_prompt_lines(spec))
+
+
+def usage_progress(task, totals):
+    """List of (option, used, limit) for every usage interval the task declares"""
+    baseline = task.usage_baseline
+    progress = []
+    for option, (counters, scale) in USAGE_INTERVALS.items():
+        limit = task.limits.get(option)
+        if limit:
+            used = sum(totals.get(c, 0.) - baseline.get(c, 0.) for c in counters) / scale
+            progress.append((option, used, limit))
+    return progress
+
+
+def is_due(task, now, totals):
+    if now >= task.next_check:
+        return True
+    return any(used >= limit for _, used, limit in usage_progress(task, totals))
+
+
+def instance_files(start_args):
+    """Default (db_file, log_file, tasks_file) of the Klipper instance started with start_args
+
+    Each instance of a multi-printer host has its own printer_data folder:
+    the files go next to its printer.cfg and klippy.log."""
+    config_file = start_args.get('config_file')
+    if not config_file:
+        return DB_FILE, LOG_FILE, TASKS_FILE
+    config_dir = os.path.dirname(os.path.abspath(os.path.expanduser(config_file)))
+    data_dir = os.path.dirname(config_dir)
+    log_file = start_args.get('log_file')
+    log_dir = (os.path.dirname(os.path.abspath(os.path.expanduser(log_file))) if log_file
+               else os.path.join(data_dir, "logs"))
+    return (os.path.join(data_dir, "database", os.path.basename(DB_FILE)),
+            os.path.join(log_dir, os.path.basename(LOG_FILE)),
+            os.path.join(config_dir, os.path.basename(TASKS_FILE)))
+
+
+def interval_row(task):
+    return (task.name, task.message, task.interval.total_seconds() / 86400.,
+            json.dumps(task.limits) if task.limits else None)
+
+
+def usage_rates(first_snapshot, totals, now):
+    """Counter units per second since a RATE_SNAPSHOT row, {} when there is none or it is too recent"""
+    if first_snapshot is None:
+        return {}
+    elapsed = (now - datetime.fromisoformat(first_snapshot[0])).total_seconds()
+    if elapsed < 3600.:
+        return {}
+    start = json.loads(first_snapshot[1])
+    return {c: max(0., v - start[c]) / elapsed for c, v in totals.items() if c in start}
+
+
+def project_due(first, period, span, max_per_task=100):
+    """Offsets of every occurrence within span seconds, as sorted (offset, task, trigger) rows
+
+    first and period hold one row per task and one column per trigger:
+    seconds until that trigger fires, then between two firings once done."""
+    if numpy is not None:
+        first = numpy.maximum(numpy.asarray(first, dtype=float), 0.)
+        period = numpy.asarray(period, dtype=float)
+        first_trigger, repeat_trigger = first.argmin(axis=1), period.argmin(axis=1)
+        first, period = first.min(axis=1), period.min(axis=1)
+        count = numpy.where(first <= span,
+                            numpy.minimum(numpy.floor((span - first) / period) + 1, max_per_task), 0)
+        count = count.astype(int)
+        task = numpy.repeat(numpy.arange(len(count)), count)
+        k = numpy.arange(count.sum()) - numpy.repeat(numpy.cumsum(count) - count, count)
+        offset = first[task] + k * period[task]
+        trigger = numpy.where(k == 0, first_trigger[task], repeat_trigger[task])
+        order = numpy.argsort(offset, kind='stable')
+        return list(zip(offset[order].tolist(), task[order].tolist(), trigger[order].tolist()))
+    rows = []
+    for i, (firsts, periods) in enumerate(zip(first, period)):
+        offset = max(0., min(firsts))
+        first_trigger = firsts.index(min(firsts))
+        step = min(periods)
+        repeat_trigger = periods.index(step)
+        k = 0
+        while offset <= span and k < max_per_task:
+            rows.append((offset, i, repeat_trigger if k else first_trigger))
+            offset += step
+            k += 1
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def forecast(tasks, now, totals, rates, horizon=timedelta(days=90)):
+    """Projected due dates within horizon as sorted (due, task, trigger) tuples
+
+    A task comes due at next_check or when a usage interval runs out at the
+    observed rates, whichever is first, then every interval_days or
+    limit / rate after that."""
+    tasks = list(tasks)
+    if not tasks:
+        return []
+    start = now.timestamp()
+    first, period = [], []
+    for task in tasks:
+        task_first = [task.next_check.timestamp() - start]
+        task_period = [task.interval.total_seconds()]
+        for option, (counters, scale) in USAGE_INTERVALS.items():
+            limit = task.limits.get(option)
+            rate = sum(rates.get(c, 0.) for c in counters) / scale
+            if limit and rate > 0.:
+                used = sum(totals.get(c, 0.) - task.usage_baseline.get(c, 0.) for c in counters) / scale
+                task_first.append((limit - used) / rate)
+                task_period.append(limit / rate)
+            else:
+                task_first.append(float('inf'))
+                task_period.append(float('inf'))
+        first.append(task_first)
+        period.append(task_period)
+    return [(now + timedelta(seconds=offset), tasks[i], FORECAST_TRIGGERS[trigger])
+            for offset, i, trigger in project_due(first, period, horizon.total_seconds())]
+
+
+def check_images(tasks, manifest_file):
+    """Warnings for task images missing from the installed asset manifest
+
+    Images outside the manifest folder only need to exist. Nothing is
+    checked before the assets were installed with a manifest."""
+    try:
+        with open(manifest_file) as f:
+            installed = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return []
+    folder = os.path.dirname(manifest_file)
+    lower = {name.lower(): name for name in installed}
+    warnings = []
+    for task in tasks:
+        if not task.image:
+            continue
+        directory, name = os.path.split(task.image)
+        if os.path.normpath(directory) != os.path.normpath(folder):
+            if not os.path.exists(task.image):
+                warnings.append(f"task '{task.name}': image {task.image} not found")
+        elif name not in installed:
+            hint = f", did you mean {lower[name.lower()]}?" if name.lower() in lower else ""
+            warnings.append(f"task '{task.name}': image {name} is not an installed asset{hint}")
+    return warnings
+
+
+def parse_float(name, options, option, default=None, minval=None):
+    value = options.get(option)
+    if value is None:
+        if default is None:
+            raise ValueError(f"task '{name}' is missing option '{option}'")
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"task '{name}': option '{option}' must be a number, not '{value}'")
+    if minval is not None and value < minval:
+        raise ValueError(f"task '{name}': option '{option}' must be at least {minval}")
+    return value
+
+
+class MaintenanceTask:
+    """A task definition and its persisted state"""
+    __slots__ = ('name', 'interval', 'message', 'prompt', 'qr_message', 'image', 'priority',
+                 'first', 'first_delay', 'limits',
+                 'last_done', 'next_check', 'first_done', 'usage_baseline')
+
+    OPTIONS = frozenset(('interval_days', 'message', 'prompt', 'qr_message', 'image', 'priority',
+                         'first', 'first_delay')) | frozenset(USAGE_INTERVALS)
+
+    def __init__(self, name, interval, message, prompt, qr_message="Scan for complete guide", image=None,
+                 priority=2, first=False, first_delay=timedelta(seconds=90), limits=None):
+        self.name = name
+        self.interval = interval
+        self.message = message
+        self.prompt = prompt
+        self.qr_message = qr_message
+        self.image = image
+        self.priority = priority
+        self.first = first
+        self.first_delay = first_delay
+        self.limits = limits or {}
+        self.last_done = None
+        self.next_check = None
+        self.first_done = False
+        self.usage_baseline = {}
+
+    @classmethod
+    def from_options(cls, name, options):
+        """Validate the raw string options of one task section"""
+        if not TASK_NAME_R.match(name):
+            raise ValueError(f"invalid task name '{name}', use letters, digits and '_'")
+        unknown = set(options) - cls.OPTIONS
+        if unknown:
+            raise ValueError(f"task '{name}': unknown option(s) {', '.join(sorted(unknown))}")
+        text = {}
+        for option in ('message', 'prompt'):
+            text[option] = " ".join(options.get(option, '').split())
+            if not text[option]:
+                raise ValueError(f"task '{name}' is missing option '{option}'")
+        priority = parse_float(name, options, 'priority', 2.)
+        if priority != int(priority):
+            raise ValueError(f"task '{name}': option 'priority' must be an integer")
+        first = options.get('first', 'False').strip().lower()
+        if first not in ('true', 'false', '1', '0', 'yes', 'no'):
+            raise ValueError(f"task '{name}': option 'first' must be True or False")
+        limits = {option: parse_float(name, options, option, minval=0.)
+                  for option in USAGE_INTERVALS if option in options}
+        return cls(name,
+                   timedelta(days=parse_float(name, options, 'interval_days', minval=0.001)),
+                   text['message'], text['prompt'],
+                   qr_message=options.get('qr_message', "Scan for complete guide").strip(),
+                   image=options.get('image', '').strip() or None,
+                   priority=int(priority),
+                   first=first in ('true', '1', 'yes'),
+                   first_delay=timedelta(seconds=parse_float(name, options, 'first_delay', 90., minval=0.)),
+                   limits={option: limit for option, limit in limits.items() if limit})
+
+
+class TaskRegistry:
+    """Tasks indexed by name, iterated in priority order"""
+    def __init__(self, tasks):
+        self.by_name = {}
+        for task in tasks:
+            if task.name in self.by_name:
+                raise ValueError(f"task '{task.name}' is declared twice")
+            self.by_name[task.name] = task
+        self.ordered = sorted(self.by_name.values(), key=lambda t: t.priority)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __iter__(self):
+        return iter(self.ordered)
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def get(self, name, default=None):
+        return self.by_name.get(name, default)
+
+
+def parse_task_sections(text, source="<defaults>"):
+    """(name, options) of every task section in a config file text"""
+    parser = configparser.RawConfigParser(delimiters=(':', '='), comment_prefixes=('#', ';'),
+                                          inline_comment_prefixes=('#', ';'), strict=True)
+    try:
+        # Yumi_Maintenance.cfg starts with plain options, give them a section
+        parser.read_string("[yumi_maintenance_file]\n" + text, source)
+    except configparser.Error as e:
+        raise ValueError(f"cannot parse {source}: {e}")
+    return [(section.split(None, 1)[1], dict(parser.items(section)))
+            for section in parser.sections()
+            if section.startswith(TASK_SECTION + ' ')]
+
+
+def read_task_file(path):
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        raise ValueError(f"cannot read {path}: {e}")
+    return parse_task_sections(text, path)
+
+
+def expand_task(name, options, sections):
+    """(name, options) for every component of a templated task, or the task itself
+
+    Components come from 'components' (a comma separated list) and from
+    'for_each' (config section prefixes: 'extruder' matches extruder,
+    extruder1, ...; 'heater_fan' matches every [heater_fan NAME])."""
+    options = dict(options)
+    components = [c.strip() for c in options.pop('components', '').split(',') if c.strip()]
+    for prefix in options.pop('for_each', '').split(','):
+        prefix = prefix.strip()
+        if prefix:
+            pattern = re.compile(re.escape(prefix) + r'(?:\d+| .+)?$')
+            components += [section for section in sections if pattern.match(section)]
+    if COMPONENT not in name:
+        if components:
+            raise ValueError(f"task '{name}' lists components but its name has no {COMPONENT}")
+        return [(name, options)]
+    expanded = []
+    for component in dict.fromkeys(components):
+        ident = re.sub(r'[^A-Za-z0-9_]+', '_', component)
+        expanded.append((name.replace(COMPONENT, ident),
+                         {k: v.replace(COMPONENT, component) for k, v in options.items()}))
+    return expanded
+
+
+class LatencyHistogram:
+    """Call durations counted in fixed buckets"""
+    # Upper bounds in seconds, the last bucket takes everything slower
+    BOUNDS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, float('inf'))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * len(self.BOUNDS)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(self.BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile (the max for the last bucket)"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean_ms': round(self.total / self.count * 1e3, 3) if self.count else 0.,
+                'p50_ms': round(self.quantile(.5) * 1e3, 3),
+                'p99_ms': round(self.quantile(.99) * 1e3, 3),
+                'max_ms': round(self.max * 1e3, 3)}
+
+
+class Instrumentation:
+    """Latency histograms around hot paths; wrap() hands back the function untouched when disabled"""
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+
+    def wrap(self, name, func):
+        if not self.enabled:
+            return func
+        histogram = self.histograms.setdefault(name, LatencyHistogram())
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.add(clock() - start)
+        return timed
+
+    def instrument(self, obj, prefix, *methods):
+        """Time the given methods of obj, including calls obj makes to itself"""
+        for method in methods:
+            setattr(obj, method, self.wrap(prefix + method.lstrip('_'), getattr(obj, method)))
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def summary(self):
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+
+class MaintenanceStore:
+    """One long-lived SQLite connection, written from a background thread"""
+    def __init__(self, printer, db_file):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.db_file = db_file
+        self.dirty = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        # Cleared while queued schema statements have not run yet
+        self.schema_ready = threading.Event()
+        self.schema_ready.set()
+
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.writer = threading.Thread(target=self._writer_loop, name="yumi_maintenance_db")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def query(self, sql, params=()):
+        """Synchronous read on the shared connection"""
+        self.schema_ready.wait(5.)
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        """Synchronous write, only meant for schema setup before printing starts"""
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def mark_dirty(self, task):
+        # Snapshot the row now so the writer thread never reads live tasks
+        self.dirty[task.name] = history_row(task)
+
+    def add_event(self, row):
+        """Journal an event_row with the next flush"""
+        self.events.append(row)
+
+    def _pending_ops(self):
+        ops = []
+        if self.dirty:
+            ops.append((HISTORY_UPSERT, list(self.dirty.values())))
+            self.dirty = {}
+        if self.events:
+            ops.append((EVENT_INSERT, self.events))
+            self.events = []
+        return ops
+
+    def flush(self, callback=None):
+        """Queue an upsert of all dirty tasks and new events; callback(error) runs on the reactor"""
+        self.submit(self._pending_ops(), callback)
+
+    def submit(self, ops, callback=None):
+        """Queue a list of (sql, rows) executemany operations as one transaction
+
+        rows None runs sql once, which schema statements need."""
+        if not ops and callback is None:
+            return
+        self.queue.put((ops, callback, None))
+
+    def create_schema(self, statements):
+        """Run statements on the writer thread, ahead of every later write; reads wait for them"""
+        self.schema_ready.clear()
+        self.queue.put(([(sql, None) for sql in statements], None, self.schema_ready))
+
+    def flush_sync(self, timeout=5.):
+        """Flush dirty tasks and events and block until they are durably on disk"""
+        ops = self._pending_ops()
+        done = threading.Event()
+        self.queue.put((ops, None, done))
+        if not done.wait(timeout):
+            logging.error("yumi_maintenance: timeout waiting for database flush")
+            return
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.flush_sync()
+        self.queue.put(None)
+        self.writer.join(5.)
+        with self.lock:
+            self.conn.close()
+
+    def _commit(self, batch):
+        with self.lock:
+            for ops, _, _ in batch:
+                for sql, rows in ops:
+                    if rows is None:
+                        self.conn.execute(sql)
+                    else:
+                        self.conn.executemany(sql, rows)
+            self.conn.commit()
+
+    def _writer_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # Coalesce everything already queued into a single commit
+            batch = [item]
+            stop = False
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            error = None
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logging.exception("yumi_maintenance: database write failed")
+                error = e
+                with self.lock:
+                    self.conn.rollback()
+            for _, callback, done in batch:
+                if callback is not None:
+                    self.reactor.register_async_callback(
+                        lambda e, cb=callback, err=error: cb(err))
+                if done is not None:
+                    done.set()
+            if stop:
+                return
+
+
+# Fields of struct pull_move in klippy/chelper/trapq.h, all doubles
+PULL_MOVE_FIELDS = ('print_time', 'move_t', 'start_v', 'accel', 'start_x', 'start_y', 'start_z',
+                    'x_r', 'y_r', 'z_r')
+PULL_MOVE = numpy.dtype([(f, 'f8') for f in PULL_MOVE_FIELDS]) if numpy is not None else None
+
+
+def move_distances(moves):
+    """Per-axis absolute travel (x, y, z) of a batch of trapq moves"""
+    dx = dy = dz = 0.
+    for m in moves:
+        dist = (m.start_v + .5 * m.accel * m.move_t) * m.move_t
+        dx += abs(m.x_r) * dist
+        dy += abs(m.y_r) * dist
+        dz += abs(m.z_r) * dist
+    return (dx, dy, dz)
+
+
+def pull_move_distances(buffers, after):
+    """(distances, moves, newest print_time) of the moves starting after `after`
+
+    buffers are (buffer, count) pairs of struct pull_move arrays, numpy reads
+    them in place instead of going through one cffi struct per move."""
+    arrays = [numpy.frombuffer(buf, PULL_MOVE, count) for buf, count in buffers if count]
+    if not arrays:
+        return (0., 0., 0.), 0, after
+    a = numpy.concatenate(arrays)
+    a = a[a['print_time'] > after]
+    if not len(a):
+        return (0., 0., 0.), 0, after
+    t = a['move_t']
+    dist = (a['start_v'] + .5 * a['accel'] * t) * t
+    distances = tuple(float(numpy.abs(a[axis]).dot(dist)) for axis in ('x_r', 'y_r', 'z_r'))
+    return distances, len(a), float(a['print_time'].max())
+
+
+def position_distances(positions):
+    """Per-axis absolute travel (x, y, z) between consecutive sampled positions"""
+    totals = [0., 0., 0.]
+    for prev, cur in zip(positions, positions[1:]):
+        for i in range(3):
+            totals[i] += abs(cur[i] - prev[i])
+    return tuple(totals)
+
+
+class DeadlineScheduler:
+    """Wall clock deadlines kept in a min-heap and served by one reactor timer"""
+    # Re-check at least hourly so wall clock steps (NTP on RTC-less boards) are noticed
+    MAX_SLEEP = 3600.
+
+    def __init__(self, reactor, callback):
+        """callback(names) runs with every name whose deadline passed in the same timer pass"""
+        self.reactor = reactor
+        self.callback = callback
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.timer = None
+        self.armed = None
+
+    def start(self):
+        self.timer = self.reactor.register_timer(self._handle_timer)
+        self._arm()
+
+    def schedule(self, name, deadline):
+        """Set (or move) the deadline of name, as a time.time() timestamp"""
+        self.deadlines[name] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), name))
+        if len(self.heap) > 2 * len(self.deadlines) + 32:
+            self._compact()
+        if self.armed is None or deadline < self.armed:
+            self._arm()
+
+    def remove(self, name):
+        # The heap entry goes stale and is dropped when it reaches the top
+        self.deadlines.pop(name, None)
+
+    def get_deadline(self, name):
+        return self.deadlines.get(name)
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if self.deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self.heap)
+
+    def _peek(self):
+        while self.heap:
+            deadline, _, name = self.heap[0]
+            if self.deadlines.get(name) == deadline:
+                return deadline
+            heapq.heappop(self.heap)
+        return None
+
+    def _waketime(self, eventtime):
+        self.armed = self._peek()
+        if self.armed is None:
+            return self.reactor.NEVER
+        return eventtime + min(max(0., self.armed - time.time()), self.MAX_SLEEP)
+
+    def _arm(self):
+        if self.timer is not None:
+            self.reactor.update_timer(self.timer, self._waketime(self.reactor.monotonic()))
+
+    def _handle_timer(self, eventtime):
+        now = time.time()
+        due = []
+        while True:
+            deadline = self._peek()
+            if deadline is None or deadline > now:
+                break
+            name = heapq.heappop(self.heap)[2]
+            del self.deadlines[name]
+            due.append(name)
+        # One call per pass, so tasks due together can share a prompt
+        if due:
+            self.callback(due)
+        return self._waketime(eventtime)
+
+
+class PromptQueue:
+    """Tasks waiting for the prompt, each held once, most urgent priority first"""
+    def __init__(self):
+        self.heap = []
+        self.queued = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queued)
+
+    def __contains__(self, name):
+        return name in self.queued
+
+    def push(self, task):
+        """Queue task unless it is already waiting; returns True if it was added"""
+        if task.name in self.queued:
+            return False
+        entry = (task.priority, next(self.counter), task.name)
+        self.queued[task.name] = task
+        heapq.heappush(self.heap, entry)
+        return True
+
+    def pop(self):
+        while self.heap:
+            name = heapq.heappop(self.heap)[2]
+            task = self.queued.pop(name, None)
+            if task is not None:
+                return task
+        return None
+
+    def pop_all(self):
+        tasks = []
+        while self.queued:
+            tasks.append(self.pop())
+        return tasks
+
+    def clear(self):
+        self.heap.clear()
+        self.queued.clear()
+
+
+class UsageTracker:
+    """Print time and filament counters sampled from print_stats at a low rate"""
+    def __init__(self, printer, store, sample_interval=30., checkpoint_interval=300.):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.store = store
+        self.sample_interval = sample_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.totals = {'print_seconds': 0., 'filament_mm': 0.}
+        self.checkpointed = {}
+        self.print_stats = None
+        self.last_sample = None
+        self.last_checkpoint = 0.
+        self.snapshot_day = None
+        self.timer = None
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """callback(totals) runs after every print_stats sample"""
+        self.listeners.append(callback)
+
+    def load(self):
+        for counter, value in self.store.query("SELECT counter, value FROM maintenance_usage"):
+            self.totals[counter] = value
+        self.checkpointed = dict(self.totals)
+
+    def handle_ready(self):
+        self.print_stats = self.printer.lookup_object('print_stats', None)
+        if self.print_stats is None:
+            return
+        eventtime = self.reactor.monotonic()
+        self.last_sample = self._read(eventtime)
+        self.last_checkpoint = eventtime
+        self.checkpoint()
+        self.timer = self.reactor.register_timer(self._sample, eventtime + self.sample_interval)
+
+    def _read(self, eventtime):
+        status = self.print_stats.get_status(eventtime)
+        return status['print_duration'], status['filament_used']
+
+    def _sample(self, eventtime):
+        duration, filament = self._read(eventtime)
+        last_duration, last_filament = self.last_sample
+        # Counters restart from zero when a new print is loaded
+        self.add('print_seconds', duration - last_duration if duration >= last_duration else duration)
+        self.add('filament_mm', filament - last_filament if filament >= last_filament else filament)
+        self.last_sample = (duration, filament)
+        for callback in self.listeners:
+            callback(self.totals)
+        if eventtime - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+            self.last_checkpoint = eventtime
+        return eventtime + self.sample_interval
+
+    def add(self, counter, delta):
+        if delta > 0.:
+            self.totals[counter] = self.totals.get(counter, 0.) + delta
+
+    def checkpoint(self):
+        """Queue an upsert of the counters that moved since the last checkpoint
+
+        The first checkpoint of a day also keeps a snapshot of all counters,
+        so usage rates do not depend on maintenance events being recorded."""
+        ops = []
+        rows = [(c, v) for c, v in self.totals.items() if self.checkpointed.get(c) != v]
+        if rows:
+            ops.append((USAGE_UPSERT, rows))
+            self.checkpointed.update(rows)
+        now = datetime.now()
+        if now.date() != self.snapshot_day:
+            ops.append((USAGE_SNAPSHOT_INSERT, [(now.date().isoformat(), now.isoformat(timespec='seconds'),
+                                                 usage_json(self.totals))]))
+            self.snapshot_day = now.date()
+        if ops:
+            self.store.submit(ops)
+
+    def snapshot(self):
+        return dict(self.totals)
+
+
+class MotionOdometer:
+    """Per-axis travel accumulated from batches of toolhead moves"""
+    # Shortest print time window read in one sample, and the delay between
+    # samples while catching up with the toolhead
+    MIN_WINDOW = .25
+    CATCHUP_DELAY = .05
+    # Moves younger than this may not be in the trapq history yet
+    FINALIZE_LAG = 1.
+
+    def __init__(self, printer, usage, sample_interval=5., batch_size=20, max_moves=500):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.usage = usage
+        # Must stay well below the 30 second trapq history kept by toolhead
+        self.sample_interval = sample_interval
+        self.batch_size = batch_size
+        # Moves one sample aims for, the window shrinks on busy prints
+        self.max_moves = max_moves
+        self.window = self.MIN_WINDOW
+        self.trapq = self.mcu = self.toolhead = self.ffi = None
+        self.last_print_time = 0.
+        self.positions = []
+        self.samples = 0
+        self.moves = 0
+        self.sample_time = 0.
+        self.max_sample_time = 0.
+        self.timer = None
+
+    def handle_ready(self):
+        self.toolhead = self.printer.lookup_object('toolhead', None)
+        motion_report = self.printer.lookup_object('motion_report', None)
+        if motion_report is not None and 'toolhead' in getattr(motion_report, 'trapqs', {}):
+            self.trapq = motion_report.trapqs['toolhead']
+            self.mcu = self.printer.lookup_object('mcu')
+            self.last_print_time = self.mcu.estimated_print_time(self.reactor.monotonic())
+            if numpy is not None:
+                try:
+                    import chelper
+                    self.ffi = chelper.get_ffi()[0]
+                except ImportError:
+                    pass
+        elif self.toolhead is None:
+            return
+        self.timer = self.reactor.register_timer(
+            self._sample, self.reactor.monotonic() + self.sample_interval)
+
+    def _sample(self, eventtime):
+        start = time.perf_counter()
+        delay = self.sample_interval
+        if self.trapq is not None:
+            delay = self._sample_trapq(eventtime)
+        else:
+            # Without motion_report only the commanded position can be polled
+            self.positions.append(self.toolhead.get_position())
+            if len(self.positions) >= self.batch_size:
+                self._add(position_distances(self.positions))
+                self.positions = self.positions[-1:]
+        elapsed = time.perf_counter() - start
+        self.samples += 1
+        self.sample_time += elapsed
+        self.max_sample_time = max(self.max_sample_time, elapsed)
+        return eventtime + delay
+
+    def _sample_trapq(self, eventtime):
+        """Count the moves of one window of print time, returns the delay to the next sample
+
+        The window is sized from the last move rate so one sample handles
+        about max_moves moves, bounding the time spent in this reactor timer."""
+        print_time = self.mcu.estimated_print_time(eventtime)
+        start = self.last_print_time
+        end = min(print_time, start + self.window)
+        moves, buffers = self.trapq.extract_trapq(start, end)
+        if self.ffi is not None:
+            distances, count, newest = pull_move_distances(
+                [(self.ffi.buffer(data), n) for data, n in buffers], start)
+        else:
+            # The move overlapping the previous window was already counted
+            moves = [m for m in moves if m.print_time > start]
+            distances, count = move_distances(moves), len(moves)
+            newest = max((m.print_time for m in moves), default=start)
+        if count:
+            self._add(distances)
+            self.moves += count
+            self.last_print_time = newest
+        elif end < print_time - self.FINALIZE_LAG:
+            # Idle stretch, nothing will show up in it any more
+            self.last_print_time = end
+        span = end - start
+        if count and span > 0.:
+            # At most double, the move rate can jump when a print starts
+            self.window = min(self.sample_interval, 2. * self.window,
+                              max(self.MIN_WINDOW, self.max_moves * span / count))
+        if end < print_time:
+            return self.CATCHUP_DELAY
+        return self.window if count else self.sample_interval
+
+    def _add(self, distances):
+        for axis, dist in zip('xyz', distances):
+            self.usage.add(f'odometer_{axis}', dist)
+
+    def get_overhead(self):
+        """Average sampling cost and its share of wall time, for benchmarking"""
+        avg = self.sample_time / self.samples if self.samples else 0.
+        return {'samples': self.samples, 'moves': self.moves,
+                'avg_sample_us': avg * 1e6, 'max_sample_us': self.max_sample_time * 1e6}
+
+
+class MaintenanceLog:
+    """Ring-buffered JSON lines logger flushed in batches by a background thread"""
+    def __init__(self, log_file, ring_size=500, flush_interval=2., max_bytes=1024 * 1024,
+                 max_age=timedelta(days=30), backups=3):
+        self.log_file = log_file
+        self.ring = collections.deque(maxlen=ring_size)
+        self.pending = []
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.cond = threading.Condition()
+        self.stopping = self.wakeup = self.writing = False
+        self.file = None
+        self.file_started = None
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="yumi_maintenance_log")
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def log(self, message, event="info", **fields):
+        record = {'ts': datetime.now().isoformat(timespec='seconds'), 'event': event, 'msg': message}
+        record.update(fields)
+        self.ring.append(record)
+        with self.cond:
+            self.pending.append(record)
+        logging.info("yumi_maintenance: %s", message)
+        return record
+
+    def recent(self, count, task=None, event=None):
+        """Most recent records from memory, newest last"""
+        records = [r for r in self.ring
+                   if (task is None or r.get('task') == task)
+                   and (event is None or r['event'] == event)]
+        return records[-count:] if count else records
+
+    def flush(self, timeout=2.):
+        """Wake the flusher and wait until everything pending is on disk"""
+        with self.cond:
+            self.wakeup = True
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: not self.pending and not self.writing, timeout)
+
+    def close(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.flusher.join(5.)
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopping or self.wakeup, self.flush_interval)
+                batch, self.pending = self.pending, []
+                self.wakeup = False
+                self.writing = bool(batch)
+                stopping = self.stopping
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception:
+                    logging.exception("yumi_maintenance: unable to write %s", self.log_file)
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+            if stopping:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write(self, batch):
+        data = "".join(json.dumps(r, default=str) + "\n" for r in batch)
+        if self.file is None:
+            self._open()
+        if self.file.tell() and (self.file.tell() + len(data) > self.max_bytes
+                                 or datetime.now() - self.file_started > self.max_age):
+            self._rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        self.file = open(self.log_file, 'a')
+        self.file_started = datetime.now()
+        if self.file.tell():
+            # Age of an existing log comes from its first record
+            try:
+                with open(self.log_file) as f:
+                    self.file_started = datetime.fromisoformat(json.loads(f.readline())['ts'])
+            except (ValueError, KeyError, TypeError):
+                self.file_started = datetime.fromtimestamp(os.path.getmtime(self.log_file))
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.log_file}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.log_file}.{i + 1}")
+        if self.backups:
+            os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+        self.file = open(self.log_file, 'a')
+        self.file_started = datetime.now()
+
+
 class YumiMaintenance:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.reactor = self.printer.get_reactor()
         self.gcode = self.printer.lookup_object('gcode')
         self.active_prompts = set()
-        self.prompt_queue = []
+        self.prompt_queue = PromptQueue()
+        self.coalesce_prompts = config.getboolean('coalesce_prompts', False)
+        self.batch_prompts = config.getboolean('batch_prompts', True)
         self.is_showing_prompt = False
+        # Prompts that came due while printing, shown once the printer is idle again
+        self.defer_while_printing = config.getboolean('defer_while_printing', True)
+        self.printing = False
+        self.pending_prompts = set()
+        self.prompt_counts = {'deferred': 0, 'flushed': 0}
+        self.print_stats = None
         self.printer_start_time = datetime.now()
+        self.postponed = set()
+        self.postpone_delay = timedelta(hours=config.getfloat('postpone_hours', 24., above=0.))
+        self.event_retention = timedelta(days=config.getint('event_retention_days', 365, minval=1))
+        self.rate_window = config.getfloat('forecast_rate_days', 30., above=0.)
 
-        # File configuration
-        self.db_file = "/home/pi/printer_data/database/yumi_maintenance.db"
-        self.log_file = "/home/pi/printer_data/logs/yumi_maintenance.log"
+        # File configuration, per Klipper instance unless set explicitly
+        db_file, log_file, tasks_file = instance_files(self.printer.get_start_args())
+        self.db_file = os.path.expanduser(config.get('db_file', db_file))
+        self.log_file = os.path.expanduser(config.get('log_file', log_file))
 
-        self.maintenance_tasks = self.init_tasks()
+        self.stats = Instrumentation(config.getboolean('instrumentation', False))
+        self.stats_refresh = 0.
+        log_options = dict(
+            ring_size=config.getint('log_ring_size', 500, minval=10),
+            max_bytes=config.getint('log_max_bytes', 1024 * 1024, minval=4096),
+            max_age=timedelta(days=config.getint('log_max_age_days', 30, minval=1)),
+            backups=config.getint('log_backups', 3, minval=0))
+        usage_options = dict(
+            sample_interval=config.getfloat('usage_sample_interval', 30., above=1.),
+            checkpoint_interval=config.getfloat('usage_checkpoint_interval', 300., above=0.))
+        odometer_options = dict(
+            sample_interval=config.getfloat('odometer_sample_interval', 5., minval=.5, maxval=20.),
+            max_moves=config.getint('odometer_max_moves', 500, minval=50))
+        self.tasks_file = os.path.expanduser(config.get('tasks_file', tasks_file))
+        try:
+            self.tasks = self.init_tasks(config)
+        except ValueError as e:
+            raise config.error(f"yumi_maintenance: {e}")
+        for warning in check_images(self.tasks, ASSET_MANIFEST):
+            logging.warning("yumi_maintenance: %s", warning)
+        self.prompt_templates = {task.name: compile_prompt([task], self.batch_prompts) for task in self.tasks}
+        # get_status() snapshot, rebuilt only once a task or the usage totals changed
+        self.task_status = {}
+        self.status_changed = set(task.name for task in self.tasks)
+        self.status = None
+        self.scheduler = DeadlineScheduler(self.reactor, self.stats.wrap('task_due', self._tasks_due))
+        # The log and database threads start only once the whole config has been accepted
+        self.logger = MaintenanceLog(self.log_file, **log_options)
+        self.store = MaintenanceStore(self.printer, self.db_file)
+        self.usage = UsageTracker(self.printer, self.store, **usage_options)
+        self.odometer = MotionOdometer(self.printer, self.usage, **odometer_options)
+        self.stats.instrument(self, "", 'log_event', 'show_prompts', 'save_history', '_check_usage_due')
+        self.stats.instrument(self.store, "db_", 'query', '_commit', 'flush_sync')
+        self.stats.instrument(self.logger, "log_", '_write')
+        self.stats.instrument(self.usage, "usage_", '_sample', 'checkpoint')
+        self.stats.instrument(self.odometer, "odometer_", '_sample')
         self.init_db()
+        self.usage.load()
         self.load_history()
         self.init_gcode_commands()
 
         self.printer.register_event_handler("klippy:ready", self.handle_ready)
-        self.log_event(f"=== Module initialized at {self.printer_start_time} ===")
+        self.printer.register_event_handler("klippy:shutdown", self.handle_shutdown)
+        self.printer.register_event_handler("klippy:disconnect", self.handle_disconnect)
+        self.printer.register_event_handler("idle_timeout:printing", self.handle_printing)
+        self.printer.register_event_handler("idle_timeout:ready", self.handle_not_printing)
+        self.printer.register_event_handler("idle_timeout:idle", self.handle_not_printing)
+        self.log_event(f"=== Module initialized at {self.printer_start_time} ===", event="init")
 
     def init_db(self):
-        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS maintenance_history
-                     (name TEXT PRIMARY KEY,
-                      last_done TEXT,
-                      next_check TEXT,
-                      first_done INTEGER DEFAULT 0)''')
-        conn.commit()
-        conn.close()
-
-    def init_tasks(self):
-        return [
-            {
-                'name': 'oil_xy_axes',
-                'interval': timedelta(month=1),
-                'message': "Lubricate X/Y axes",
-                'prompt': "Code: A00 - MAINTENANCE: Lubricate X/Y axes (Monthly) Scan for complete guide",
-                'qr_message': "Scan for complete guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/xyz.png",
-                'priority': 1,
-                'first': True,
-                'first_delay': timedelta(seconds=90)
-            },
-            {
-                'name': 'oil_z_axes',
-                'interval': timedelta(month=3),
-                'message': "Lubricate Z axes",
-                'prompt': "Code: A00 - MAINTENANCE: Lubricate Z axes (Monthly) Scan for complete guide",
-                'qr_message': "Scan for complete guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/xyz.png",
-                'priority': 1,
-                'first': True,
-                'first_delay': timedelta(seconds=90)
-            },
-            {
-                'name': 'clean_nozzle',
-                'interval': timedelta(week=2),
-                'message': "Clean nozzle",
-                'prompt': "Code: E00 - MAINTENANCE: Clean nozzle (Weekly) Scan for complete guide",
-                'qr_message': "Cleaning guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/noozle.png",
-                'priority': 2,
-                'first': False,
-                'first_delay': timedelta(seconds=90)
-            },
-            {
-                'name': 'clean_plate',
-                'interval': timedelta(week=1),
-                'message': "Clean Plate",
-                'prompt': "Code: P00 - MAINTENANCE: Clean Plate (Weekly) Scan for complete guide",
-                'qr_message': "Cleaning guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/plate.png",
-                'priority': 2,
-                'first': False,
-                'first_delay': timedelta(seconds=90)
-            },
-            {
-                'name': 'belt_tension',
-                'interval': timedelta(month=2),
-                'message': "Clean Plate",
-                'prompt': "Code: A01 - MAINTENANCE: Belt Tension (Weekly) Scan for complete guide",
-                'qr_message': "Cleaning guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/belt_tension.png",
-                'priority': 2,
-                'first': False,
-                'first_delay': timedelta(seconds=90)
-            },
-            {
-                'name': 'clean_fan',
-                'interval': timedelta(week=2),
-                'message': "Clean Fan",
-                'prompt': "Code: A01 - MAINTENANCE: Clean Fan (Weekly) Scan for complete guide",
-                'qr_message': "Cleaning guide",
-                'imgqr': "/home/pi/KlipperScreen/styles/maintenance/clean_fan.png",
-                'priority': 2,
-                'first': False,
-                'first_delay': timedelta(seconds=90)
-            }
-        ]
+        """Only the tables read during config load, see init_db_deferred for the rest"""
+        self.store.execute(HISTORY_TABLE)
+        columns = [row[1] for row in self.store.query("PRAGMA table_info(maintenance_history)")]
+        if 'usage_baseline' not in columns:
+            self.store.execute("ALTER TABLE maintenance_history ADD COLUMN usage_baseline TEXT")
+        self.store.execute(USAGE_TABLE)
+        self.store.execute(USAGE_SNAPSHOT_TABLE)
+
+    def init_db_deferred(self):
+        """Queue the event and change feed schema on the writer, ahead of any history write"""
+        self.store.create_schema(SCHEMA + CHANGES_BACKFILL)
 
-    def log_event(self, message):
-        """Detailed logging with standardized format"""
-        log_entry = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}"
-        with open(self.log_file, 'a') as f:
-            f.write(log_entry + "\n")
-        print(log_entry)  # Also show in Klipper console
+    def init_tasks(self, config):
+        """Task sections from printer.cfg and the tasks file, else the built-in tasks"""
+        declared = [(section.get_name().split(None, 1)[1],
+                     {option: section.get(option) for option in section.get_prefix_options('')})
+                    for section in config.get_prefix_sections(TASK_SECTION + ' ')]
+        declared += read_task_file(self.tasks_file)
+        if not declared:
+            declared = parse_task_sections(DEFAULT_TASKS)
+        sections = [section.get_name() for section in config.get_prefix_sections('')]
+        tasks = []
+        for name, options in declared:
+            for task_name, task_options in expand_task(name, options, sections):
+                tasks.append(MaintenanceTask.from_options(task_name, task_options))
+        return TaskRegistry(tasks)
+
+    def log_event(self, message, event="info", **fields):
+        """Structured logging, written to disk in batches off the reactor"""
+        return self.logger.log(message, event, **fields)
 
     def load_history(self):
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
+        """Fill every task from one query; rows of new tasks are written once klippy is ready"""
         now = datetime.now()
+        history = {row[0]: row[1:] for row in self.store.query(
+            "SELECT name, last_done, next_check, first_done, usage_baseline FROM maintenance_history")}
+        registered = []
 
-        for task in self.maintenance_tasks:
-            c.execute("SELECT last_done, next_check, first_done FROM maintenance_history WHERE name=?", (task['name'],))
-            result = c.fetchone()
+        for task in self.tasks:
+            result = history.get(task.name)
 
             if result:
-                task['last_done'] = datetime.fromisoformat(result[0]) if result[0] else None
-                task['next_check'] = datetime.fromisoformat(result[1]) if result[1] else now + task['interval']
-                task['first_done'] = bool(result[2])
-                self.log_event(f"Loaded history - {task['name']}: last done {task['last_done']}, next due {task['next_check']}")
+                task.last_done = datetime.fromisoformat(result[0]) if result[0] else None
+                task.next_check = datetime.fromisoformat(result[1]) if result[1] else now + task.interval
+                task.first_done = bool(result[2])
+                task.usage_baseline = json.loads(result[3]) if result[3] else {}
             else:
-                task['last_done'] = None
-                task['next_check'] = now + task['interval']
-                task['first_done'] = False
-                c.execute("INSERT INTO maintenance_history (name, last_done, next_check, first_done) VALUES (?, ?, ?, ?)",
-                         (task['name'], None, task['next_check'].isoformat(), 0))
-                self.log_event(f"New task registered - {task['name']}: first due {task['next_check']}")
-
-        conn.commit()
-        conn.close()
-
-    def save_history(self):
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        for task in self.maintenance_tasks:
-            c.execute('''INSERT OR REPLACE INTO maintenance_history
-                         (name, last_done, next_check, first_done)
-                         VALUES (?, ?, ?, ?)''',
-                     (task['name'],
-                      task['last_done'].isoformat() if task['last_done'] else None,
-                      task['next_check'].isoformat(),
-                      int(task.get('first_done', False))))
-        conn.commit()
-        conn.close()
-
-    def show_prompt(self, task):
-        if task['name'] in self.active_prompts or self.is_showing_prompt:
-            self.prompt_queue.append(task)
-            self.log_event(f"Task queued: {task['name']}")
+                task.last_done = None
+                task.next_check = now + task.interval
+                task.first_done = False
+                task.usage_baseline = self.usage.snapshot()
+                self.store.mark_dirty(task)
+                registered.append(task.name)
+
+        loaded = len(self.tasks) - len(registered)
+        if loaded:
+            self.log_event(f"Loaded history of {loaded} tasks", event="history_loaded", count=loaded)
+        if registered:
+            self.log_event(f"New tasks registered: {', '.join(registered)}", event="task_registered",
+                           tasks=registered)
+
+    def save_history(self, tasks=None, callback=None):
+        """Queue the given (or already dirty) tasks for a background upsert"""
+        for task in tasks or ():
+            self.store.mark_dirty(task)
+        self.store.flush(callback)
+
+    def _history_saved(self, task_name, error):
+        if error is not None:
+            self.log_event(f"SAVE FAILED - Task: {task_name}: {error}", event="error", task=task_name)
+
+    def handle_shutdown(self):
+        self.usage.checkpoint()
+        self.store.flush_sync()
+        self.logger.flush()
+
+    def handle_disconnect(self):
+        self.usage.checkpoint()
+        self.store.close()
+        self.logger.close()
+
+    def handle_printing(self, print_time):
+        if self.defer_while_printing and not self.printing:
+            self.printing = True
+            self.status = None
+
+    def handle_not_printing(self, print_time):
+        """idle_timeout Ready/Idle: show what came due during the print
+
+        A paused print keeps prompts pending until it resumes and ends, or
+        until idle_timeout reports Idle after a cancel."""
+        if not self.printing:
             return
-            
-        self.active_prompts.add(task['name'])
+        if self.print_stats is not None:
+            state = self.print_stats.get_status(self.reactor.monotonic())['state']
+            if state in ("printing", "paused"):
+                return
+        self.printing = False
+        self.status = None
+        self._flush_pending()
+
+    def _flush_pending(self):
+        """Queue every pending prompt at once, then show the next dialog"""
+        if self.pending_prompts:
+            names, self.pending_prompts = sorted(self.pending_prompts), set()
+            self.prompt_counts['flushed'] += len(names)
+            self._status_changed(names)
+            for name in names:
+                self.prompt_queue.push(self.tasks[name])
+            self.log_event(f"Print ended, showing deferred prompts: {', '.join(names)}",
+                           event="prompts_flushed", tasks=names)
+        if not self.is_showing_prompt:
+            self._next_prompt()
+
+    def show_prompts(self, tasks):
+        """Prompt for tasks that came due together, in one dialog when coalesce_prompts is set"""
+        tasks = [task for task in tasks if task.name not in self.active_prompts]
+        if self.printing:
+            for task in tasks:
+                if task.name not in self.pending_prompts and task.name not in self.prompt_queue:
+                    self.pending_prompts.add(task.name)
+                    self.prompt_counts['deferred'] += 1
+                    self._status_changed([task.name])
+                    self.log_event(f"Task deferred until the print ends: {task.name}",
+                                   event="prompt_deferred", task=task.name)
+            return
+        for task in tasks:
+            if self.prompt_queue.push(task):
+                self._status_changed([task.name])
+                if self.is_showing_prompt:
+                    self.log_event(f"Task queued: {task.name}", event="prompt_queued", task=task.name)
+        if not self.is_showing_prompt:
+            self._next_prompt()
+
+    def _display_prompt(self, tasks):
         self.is_showing_prompt = True
-        self.log_event(f"Displaying maintenance prompt: {task['name']}")
-        
-        
-        img_part = f'RESPOND TYPE=command MSG="action:prompt_image {task["imgqr"]}"\n' if 'imgqr' in task else ''
-        
-        gcode_script = f"""
-        RESPOND TYPE=command MSG="action:prompt_begin Maintenance Required"
-        RESPOND TYPE=command MSG="action:prompt_text {task['prompt']}"
-        {img_part}
-	RESPOND TYPE=command MSG="action:prompt_footer_button Not Now|MAINTENANCE_POSTPONE TASK={task['name']}"
-        RESPOND TYPE=command MSG="action:prompt_footer_button Confirm|MAINTENANCE_CONFIRM TASK={task['name']}"
-        RESPOND TYPE=command MSG="action:prompt_close_on_click"
-        RESPOND TYPE=command MSG="action:prompt_show"
-        """
-        self.gcode.run_script_from_command(gcode_script)
+        self._status_changed(task.name for task in tasks)
+        for task in tasks:
+            self.active_prompts.add(task.name)
+            self.log_event(f"Displaying maintenance prompt: {task.name}", event="prompt_shown", task=task.name)
+        self.record_events(tasks, "shown")
+        if len(tasks) == 1:
+            lines = self.prompt_templates[tasks[0].name]
+        else:
+            lines = compile_prompt(tasks, self.batch_prompts)
+        for line in lines:
+            self.gcode.respond_raw(line)
 
     def handle_ready(self):
-        """Schedule display after 1 minute 30"""
-        for task in self.maintenance_tasks:
-            if task.get('first', False) and not task.get('first_done', False):
-                delay = task['first_delay'].total_seconds()
-                self.reactor.register_timer(
-                    lambda e, t=task: self._trigger_prompt(t),
-                    self.reactor.monotonic() + delay
-                )
-                self.log_event(f"Task '{task['name']}' scheduled in {delay} seconds")
-
-    def _trigger_prompt(self, task):
-        """Trigger for delayed display"""
-        if not task.get('first_done', False):
-            self.show_prompt(task)
-        return self.reactor.NEVER
+        """Arm every task deadline, never earlier than first_delay after startup"""
+        self.init_db_deferred()
+        self.store.submit([("DELETE FROM maintenance_intervals", [()]),
+                           (INTERVAL_INSERT, [interval_row(task) for task in self.tasks])])
+        self.save_history()
+        self.usage.handle_ready()
+        self.odometer.handle_ready()
+        self.print_stats = self.printer.lookup_object('print_stats', None)
+        now = datetime.now()
+        for task in self.tasks:
+            earliest = now + task.first_delay
+            if task.first and not task.first_done:
+                deadline = earliest
+                delay = task.first_delay.total_seconds()
+                self.log_event(f"Task '{task.name}' scheduled in {delay} seconds",
+                               event="task_scheduled", task=task.name)
+            else:
+                deadline = max(task.next_check, earliest)
+            self.scheduler.schedule(task.name, deadline.timestamp())
+        self.scheduler.start()
+        self.usage.add_listener(self._check_usage_due)
+        self.usage.add_listener(self._usage_changed)
+        self.reactor.register_timer(self.stats.wrap('compact_events', self._compact_events),
+                                    self.reactor.monotonic() + 60.)
+
+    def get_status(self, eventtime):
+        if self.stats.enabled and eventtime >= self.stats_refresh:
+            # Latencies change all the time, only publish them every few seconds
+            self.stats_refresh = eventtime + 5.
+            self.status = None
+        if self.status is None:
+            for name in self.status_changed:
+                self.task_status[name] = self._task_status(self.tasks[name])
+            self.status_changed.clear()
+            # A new dict every time, clients compare it with the previous one
+            self.status = {
+                'tasks': dict(self.task_status),
+                'active': sorted(self.active_prompts),
+                'queued': len(self.prompt_queue),
+                'showing_prompt': self.is_showing_prompt,
+                'printing': self.printing,
+                'pending': sorted(self.pending_prompts),
+                'prompts_deferred': self.prompt_counts['deferred'],
+                'prompts_flushed': self.prompt_counts['flushed'],
+                'usage': self.usage.snapshot(),
+                'stats': self.stats.summary(),
+            }
+        return self.status
+
+    def _task_status(self, task):
+        if task.name in self.active_prompts:
+            state = "active"
+        elif task.name in self.pending_prompts:
+            state = "pending"
+        elif task.name in self.prompt_queue:
+            state = "queued"
+        elif task.name in self.postponed:
+            state = "postponed"
+        else:
+            state = "scheduled"
+        deadline = self.scheduler.get_deadline(task.name)
+        return {
+            'state': state,
+            'message': task.message,
+            'priority': task.priority,
+            'last_done': task.last_done.isoformat(timespec='seconds') if task.last_done else None,
+            'next_check': task.next_check.isoformat(timespec='seconds'),
+            'next_prompt': (datetime.fromtimestamp(deadline).isoformat(timespec='seconds')
+                            if deadline is not None else None),
+            'first_done': task.first_done,
+            'usage_limits': dict(task.limits),
+            'usage_baseline': dict(task.usage_baseline),
+        }
+
+    def _status_changed(self, names):
+        self.status_changed.update(names)
+        self.status = None
+
+    def _usage_changed(self, totals):
+        self.status = None
+
+    def record_events(self, tasks, action, now=None):
+        """Journal action for tasks in maintenance_events"""
+        totals = self.usage.snapshot()
+        for task in tasks:
+            self.store.add_event(event_row(task.name, action, totals, now))
+        self.store.flush()
+
+    def _compact_events(self, eventtime):
+        """Once a day, fold events past the retention period into monthly totals and trim the
+        change feed and usage snapshots"""
+        cutoff = (datetime.now() - self.event_retention).isoformat(timespec='seconds')
+        self.store.submit([(EVENT_FOLD, [(cutoff,)]), (EVENT_PURGE, [(cutoff,)]),
+                           (CHANGES_COMPACT, [(cutoff,)]), (USAGE_SNAPSHOT_PURGE, [(cutoff,)])],
+                          lambda err: self._history_saved("events", err))
+        return eventtime + 86400.
+
+    def _reschedule(self, task, deadline):
+        self._status_changed([task.name])
+        self.postponed.discard(task.name)
+        self.scheduler.schedule(task.name, deadline.timestamp())
+
+    def _tasks_due(self, task_names):
+        """Scheduler callback with every task whose deadline passed in the same pass"""
+        self.postponed.difference_update(task_names)
+        tasks = [self.tasks[name] for name in task_names if name in self.tasks]
+        self._status_changed(task.name for task in tasks)
+        self.show_prompts(tasks)
+
+    def _check_usage_due(self, totals):
+        """Fire tasks whose usage interval ran out before their calendar deadline"""
+        now = datetime.now()
+        for task in self.tasks:
+            name = task.name
+            if (name in self.postponed or name in self.active_prompts or name in self.prompt_queue
+                    or name in self.pending_prompts):
+                continue
+            deadline = self.scheduler.get_deadline(name)
+            if deadline is None or deadline <= now.timestamp():
+                continue
+            if any(used >= limit for _, used, limit in usage_progress(task, totals)):
+                self._status_changed([name])
+                self.scheduler.schedule(name, now.timestamp())
 
     def _next_prompt(self):
         """Show next prompt in queue"""
         self.is_showing_prompt = False
-        if self.prompt_queue:
-            task = self.prompt_queue.pop(0)
-            self.show_prompt(task)
+        self.status = None
+        # Still queued, _flush_pending shows them once the print ends
+        if not self.prompt_queue or self.printing:
+            return
+        if self.coalesce_prompts:
+            self._display_prompt(self.prompt_queue.pop_all())
+        else:
+            self._display_prompt([self.prompt_queue.pop()])
+
+    def _close_prompt(self):
+        """End the dialog; tasks it still showed go back to the queue"""
+        self._status_changed(self.active_prompts)
+        for name in self.active_prompts:
+            self.prompt_queue.push(self.tasks[name])
+        self.active_prompts.clear()
+        self.gcode.respond_raw(action_line("prompt_end"))
+        self.reactor.register_callback(lambda e: self._next_prompt())
+
+    def _task_names(self, gcmd):
+        """TASK accepts a comma separated list; returns (active, unknown) names"""
+        names = [n.strip() for n in gcmd.get('TASK').split(',') if n.strip()]
+        active = [n for n in names if n in self.active_prompts]
+        return active, [n for n in names if n not in self.active_prompts]
 
     def cmd_postpone_maintenance(self, gcmd):
-        task_name = gcmd.get('TASK')
-        if task_name in self.active_prompts:
-            self.active_prompts.remove(task_name)
-            self.gcode.run_script_from_command('RESPOND TYPE=command MSG="action:prompt_end"')
-            self.log_event(f"MAINTENANCE POSTPONED - Task: {task_name}, Reason: User selected 'Postpone'")
-            gcmd.respond_info(f"Maintenance {task_name} postponed.")
-            self.reactor.register_callback(lambda e: self._next_prompt())
-        else:
-            self.log_event(f"POSTPONE ATTEMPT FAILED - No active prompt for: {task_name}")
+        task_names, missing = self._task_names(gcmd)
+        for task_name in missing:
+            self.log_event(f"POSTPONE ATTEMPT FAILED - No active prompt for: {task_name}",
+                           event="postpone_failed", task=task_name)
+        if not task_names:
             gcmd.respond_info("No active prompt for this task")
+            return
+        for task_name in task_names:
+            self.active_prompts.remove(task_name)
+            self._reschedule(self.tasks[task_name], datetime.now() + self.postpone_delay)
+            self.postponed.add(task_name)
+            self.log_event(f"MAINTENANCE POSTPONED - Task: {task_name}, Reason: User selected 'Postpone'",
+                           event="postponed", task=task_name)
+        self.record_events([self.tasks[name] for name in task_names], "postponed")
+        self._close_prompt()
+        gcmd.respond_info(f"Maintenance {', '.join(task_names)} postponed.")
 
     def cmd_confirm_maintenance(self, gcmd):
-        task_name = gcmd.get('TASK')
-        if task_name in self.active_prompts:
-            self.active_prompts.remove(task_name)
-            now = datetime.now()
-            for task in self.maintenance_tasks:
-                if task['name'] == task_name:
-                    previous_last_done = task['last_done']
-                    task['last_done'] = now
-                    task['next_check'] = now + task['interval']
-                    task['first_done'] = True
-                    self.save_history()
-                    
-                    # Detailed logging
-                    log_details = [
-                        f"MAINTENANCE CONFIRMED - Task: {task_name}",
-                        f"Completion date: {now.strftime('%Y-%m-%d %H:%M:%S')}",
-                        f"Previous completion: {previous_last_done.strftime('%Y-%m-%d %H:%M:%S') if previous_last_done else 'First completion'}",
-                        f"Next due: {task['next_check'].strftime('%Y-%m-%d %H:%M:%S')}"
-                    ]
-                    self.log_event("\n  ".join(log_details))
-                    
-                    break
-            
-            self.gcode.run_script_from_command('RESPOND TYPE=command MSG="action:prompt_end"')
-            gcmd.respond_info(f"Maintenance {task_name} confirmed.")
-            self.reactor.register_callback(lambda e: self._next_prompt())
-        else:
-            self.log_event(f"CONFIRM ATTEMPT FAILED - No active prompt for: {task_name}")
+        task_names, missing = self._task_names(gcmd)
+        for task_name in missing:
+            self.log_event(f"CONFIRM ATTEMPT FAILED - No active prompt for: {task_name}",
+                           event="confirm_failed", task=task_name)
+        if not task_names:
             gcmd.respond_info("No active prompt for this task")
+            return
+        now = datetime.now()
+        confirmed = []
+        for task_name in task_names:
+            self.active_prompts.remove(task_name)
+            task = self.tasks[task_name]
+            previous_last_done = task.last_done
+            task.last_done = now
+            task.next_check = now + task.interval
+            task.first_done = True
+            task.usage_baseline = self.usage.snapshot()
+            self._reschedule(task, task.next_check)
+            confirmed.append(task)
+
+            # Detailed logging
+            log_details = [
+                f"MAINTENANCE CONFIRMED - Task: {task_name}",
+                f"Completion date: {now.strftime('%Y-%m-%d %H:%M:%S')}",
+                f"Previous completion: {previous_last_done.strftime('%Y-%m-%d %H:%M:%S') if previous_last_done else 'First completion'}",
+                f"Next due: {task.next_check.strftime('%Y-%m-%d %H:%M:%S')}"
+            ]
+            self.log_event("\n  ".join(log_details), event="confirmed", task=task_name,
+                           next_check=task.next_check.isoformat(timespec='seconds'))
+        names = ", ".join(task_names)
+        totals = self.usage.snapshot()
+        for task in confirmed:
+            self.store.add_event(event_row(task.name, "confirmed", totals, now))
+        self.save_history(confirmed, lambda err: self._history_saved(names, err))
+        self._close_prompt()
+        gcmd.respond_info(f"Maintenance {names} confirmed.")
 
     def cmd_maintenance_status(self, gcmd):
         now = datetime.now()
+        totals = self.usage.snapshot()
         output = ["Maintenance status:"]
         
-        for task in sorted(self.maintenance_tasks, key=lambda x: x['priority']):
-            status = "? Up to date" if now < task['next_check'] else "?? Required"
-            last_done = f"last done: {task['last_done'].strftime('%Y-%m-%d %H:%M:%S')}" if task['last_done'] else "never done"
-            next_check = task['next_check'].strftime('%Y-%m-%d %H:%M:%S')
-            output.append(f"{task['name']}: {status} ({last_done}, next due: {next_check})")
+        for task in self.tasks:
+            status = "?? Required" if is_due(task, now, totals) else "? Up to date"
+            last_done = f"last done: {task.last_done.strftime('%Y-%m-%d %H:%M:%S')}" if task.last_done else "never done"
+            next_check = task.next_check.strftime('%Y-%m-%d %H:%M:%S')
+            usage = "".join(f", {option[len('interval_'):]}: {used:.1f}/{limit:g}"
+                            for option, used, limit in usage_progress(task, totals))
+            output.append(f"{task.name}: {status} ({last_done}, next due: {next_check}{usage})")
+        output.append("Odometer: " + ", ".join(
+            f"{axis.upper()}={totals.get(f'odometer_{axis}', 0.) / 1000.:.1f}m" for axis in 'xyz'))
         
         full_status = "\n".join(output)
-        self.log_event(f"STATUS REQUESTED:\n{full_status}")
+        self.log_event(f"STATUS REQUESTED:\n{full_status}", event="status")
         gcmd.respond_info(full_status)
 
     def cmd_reset_maintenance(self, gcmd):
@@ -263,39 +1716,149 @@ class YumiMaintenance:
             # Clear all active prompts
             self.active_prompts.clear()
             self.prompt_queue.clear()
+            self.pending_prompts.clear()
             self.is_showing_prompt = False
             
-            # Reset database
-            conn = sqlite3.connect(self.db_file)
-            c = conn.cursor()
-            c.execute("DELETE FROM maintenance_history")
-            conn.commit()
-            conn.close()
-        
-            
             # Reload with fresh state
             now = datetime.now()
-            for task in self.maintenance_tasks:
-                task['last_done'] = None
-                task['next_check'] = now + task['interval']
-                task['first_done'] = False
-            
-            self.save_history()
-            self.log_event("MAINTENANCE SYSTEM RESET - All history cleared")
+            totals = self.usage.snapshot()
+            for task in self.tasks:
+                task.last_done = None
+                task.next_check = now + task.interval
+                task.first_done = False
+                task.usage_baseline = dict(totals)
+                self._reschedule(task, task.next_check)
+
+            # Reset database in a single background transaction, the event journal is kept
+            self.store.dirty.clear()
+            self.store.submit([
+                ("DELETE FROM maintenance_history", [()]),
+                (HISTORY_UPSERT, [history_row(t) for t in self.tasks]),
+                (EVENT_INSERT, [event_row(t.name, "reset", totals, now) for t in self.tasks]),
+            ], lambda err: self._history_saved("*", err))
+            self.log_event("MAINTENANCE SYSTEM RESET - All history cleared", event="reset")
             gcmd.respond_info("Maintenance system reset complete. All history cleared.")
         except Exception as e:
-            self.log_event(f"RESET FAILED: {str(e)}")
+            self.log_event(f"RESET FAILED: {str(e)}", event="error")
             gcmd.respond_error(f"Maintenance reset failed: {str(e)}")
 
+    def cmd_maintenance_log(self, gcmd):
+        """Show recent log records straight from the in-memory ring buffer"""
+        count = gcmd.get_int('COUNT', 20, minval=0)
+        records = self.logger.recent(count, task=gcmd.get('TASK', None), event=gcmd.get('EVENT', None))
+        if not records:
+            gcmd.respond_info("No matching maintenance log entries")
+            return
+        gcmd.respond_info("\n".join(f"[{r['ts']}] {r['event']}: {r['msg']}" for r in records))
+
+    def cmd_maintenance_events(self, gcmd):
+        """Page through the event journal newest first, or count events per month"""
+        # (condition, value) pairs on maintenance_events and on maintenance_event_totals
+        events, totals = [], []
+        for key, column in (('TASK', 'task'), ('ACTION', 'action')):
+            value = gcmd.get(key, None)
+            if value:
+                value = value if key == 'TASK' else value.lower()
+                events.append((f"{column}=?", value))
+                totals.append((f"{column}=?", value))
+        since = gcmd.get('SINCE', None)
+        if since:
+            try:
+                since = datetime.fromisoformat(since).isoformat(timespec='seconds')
+            except ValueError:
+                raise gcmd.error(f"Invalid SINCE '{since}', expected YYYY-MM-DD")
+            events.append(("ts>=?", since))
+            totals.append(("period>=?", since[:7]))
+
+        if gcmd.get_int('SUMMARY', 0):
+            events_where, events_params = sql_where(events)
+            totals_where, totals_params = sql_where(totals)
+            rows = self.store.query(
+                "SELECT period, task, action, SUM(count) FROM ("
+                " SELECT substr(ts, 1, 7) AS period, task, action, COUNT(*) AS count"
+                f" FROM maintenance_events{events_where} GROUP BY period, task, action"
+                " UNION ALL SELECT period, task, action, count"
+                f" FROM maintenance_event_totals{totals_where})"
+                " GROUP BY period, task, action ORDER BY period DESC, task, action",
+                events_params + totals_params)
+            if not rows:
+                gcmd.respond_info("No matching maintenance events")
+                return
+            gcmd.respond_info("\n".join(f"{period} {task}: {action} x{count}"
+                                         for period, task, action, count in rows))
+            return
+
+        limit = gcmd.get_int('LIMIT', 20, minval=1, maxval=200)
+        before = gcmd.get_int('BEFORE', 0, minval=0)
+        if before:
+            events.append(("id<?", before))
+        events_where, params = sql_where(events)
+        rows = self.store.query("SELECT id, ts, task, action FROM maintenance_events"
+                                f"{events_where} ORDER BY id DESC LIMIT ?", params + [limit + 1])
+        if not rows:
+            gcmd.respond_info("No matching maintenance events")
+            return
+        output = [f"#{id} [{ts}] {task}: {action}" for id, ts, task, action in rows[:limit]]
+        if len(rows) > limit:
+            args = "".join(f" {key}={gcmd.get(key)}" for key in ('TASK', 'ACTION', 'SINCE', 'LIMIT')
+                           if gcmd.get(key, None))
+            output.append(f"More: MAINTENANCE_EVENTS BEFORE={rows[limit - 1][0]}{args}")
+        gcmd.respond_info("\n".join(output))
+
+    def cmd_maintenance_forecast(self, gcmd):
+        """Projected due dates over the next DAYS days, from the intervals and the recent usage rate"""
+        days = gcmd.get_float('DAYS', 90., above=0.)
+        limit = gcmd.get_int('LIMIT', 30, minval=1, maxval=500)
+        names = [n.strip() for n in gcmd.get('TASK', '').split(',') if n.strip()]
+        unknown = [n for n in names if n not in self.tasks]
+        if unknown:
+            raise gcmd.error(f"Unknown task(s): {', '.join(unknown)}")
+        tasks = [self.tasks[n] for n in names] if names else self.tasks
+        now = datetime.now()
+        totals = self.usage.snapshot()
+        window = (now - timedelta(days=self.rate_window)).isoformat(timespec='seconds')
+        rows = self.store.query(RATE_SNAPSHOT, (window, window))
+        rates = usage_rates(rows[0] if rows else None, totals, now)
+        due = forecast(tasks, now, totals, rates, timedelta(days=days))
+        if not due:
+            gcmd.respond_info(f"No maintenance due in the next {days:g} days")
+            return
+        output = [f"Maintenance forecast, next {days:g} days:"]
+        output += [f"{when.strftime('%Y-%m-%d %H:%M')} {task.name} ({trigger})"
+                   for when, task, trigger in due[:limit]]
+        if len(due) > limit:
+            output.append(f"... {len(due) - limit} more, raise LIMIT to see them")
+        gcmd.respond_info("\n".join(output))
+
+    def cmd_maintenance_stats(self, gcmd):
+        """Latency of the instrumented paths since startup or the last RESET=1"""
+        if not self.stats.enabled:
+            gcmd.respond_info("Instrumentation is disabled, set instrumentation: True in [yumi_maintenance]")
+            return
+        output = ["Maintenance latency (ms):"]
+        for name, h in self.stats.summary().items():
+            if h['count']:
+                output.append(f"{name}: n={h['count']} mean={h['mean_ms']:.3f} p50<={h['p50_ms']:.3f}"
+                              f" p99<={h['p99_ms']:.3f} max={h['max_ms']:.3f}")
+        if gcmd.get_int('RESET', 0):
+            self.stats.reset()
+            self.status = None
+            output.append("Histograms reset")
+        gcmd.respond_info("\n".join(output))
+
     def init_gcode_commands(self):
-        self.gcode.register_command("MAINTENANCE_POSTPONE", self.cmd_postpone_maintenance,
-                                  desc="Postpone a maintenance task")
-        self.gcode.register_command("MAINTENANCE_CONFIRM", self.cmd_confirm_maintenance,
-                                  desc="Confirm maintenance was completed")
-        self.gcode.register_command("MAINTENANCE_STATUS", self.cmd_maintenance_status,
-                                  desc="Show detailed maintenance status")
-        self.gcode.register_command("MAINTENANCE_RESET", self.cmd_reset_maintenance,
-                                  desc="Reset all maintenance history")
+        commands = (
+            ("MAINTENANCE_POSTPONE", self.cmd_postpone_maintenance, "Postpone a maintenance task"),
+            ("MAINTENANCE_CONFIRM", self.cmd_confirm_maintenance, "Confirm maintenance was completed"),
+            ("MAINTENANCE_STATUS", self.cmd_maintenance_status, "Show detailed maintenance status"),
+            ("MAINTENANCE_RESET", self.cmd_reset_maintenance, "Reset all maintenance history"),
+            ("MAINTENANCE_LOG", self.cmd_maintenance_log, "Show recent maintenance log entries"),
+            ("MAINTENANCE_EVENTS", self.cmd_maintenance_events, "Query the maintenance event journal"),
+            ("MAINTENANCE_FORECAST", self.cmd_maintenance_forecast, "Forecast upcoming maintenance"),
+            ("MAINTENANCE_STATS", self.cmd_maintenance_stats, "Show maintenance latency histograms"),
+        )
+        for name, handler, desc in commands:
+            self.gcode.register_command(name, self.stats.wrap(name.lower(), handler), desc=desc)
 
 def load_config(config):
     return YumiMaintenance(config)
\ No newline at end of file
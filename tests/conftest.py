@@ -0,0 +1,25 @@
+"""Tests run the scripts in-process against the stand-ins of benchmarks/fakes.py"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import fakes  # noqa: E402  (also puts scripts/ on sys.path)
+
+
+@pytest.fixture
+def maintenance(tmp_path):
+    """Factory of ready YumiMaintenance instances, all disconnected after the test"""
+    started = []
+
+    def start(options=None, sections=None):
+        module, printer, instance = fakes.load_maintenance(str(tmp_path), options, sections)
+        printer.send_event("klippy:ready")
+        printer.reactor.run_pending()
+        started.append(printer)
+        return printer, instance
+
+    yield start
+    for printer in started:
+        printer.send_event("klippy:disconnect")
@@ -0,0 +1,110 @@
+"""Change feed triggers of yumi_maintenance.db and the fleet collector merge"""
+import json
+import sqlite3
+
+import maintenance_collector
+import maintenance_feed
+import yumi_maintenance
+
+
+def printer_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(yumi_maintenance.HISTORY_TABLE)
+    for sql in yumi_maintenance.SCHEMA:
+        conn.execute(sql)
+    return conn
+
+
+def history(name, next_check, last_done=None):
+    return (name, last_done, next_check, 1 if last_done else 0, '{}')
+
+
+def changes(path, since=0):
+    conn = maintenance_feed.connect(path)
+    try:
+        return list(maintenance_feed.iter_changes(conn, since))
+    finally:
+        conn.close()
+
+
+def test_triggers_record_real_changes_only(tmp_path):
+    path = str(tmp_path / "yumi_maintenance.db")
+    conn = printer_db(path)
+    conn.execute(yumi_maintenance.HISTORY_UPSERT, history('clean_plate', '2026-01-01T00:00:00'))
+    # Same values again: the update trigger must stay quiet
+    conn.execute(yumi_maintenance.HISTORY_UPSERT, history('clean_plate', '2026-01-01T00:00:00'))
+    conn.execute(yumi_maintenance.HISTORY_UPSERT,
+                 history('clean_plate', '2026-01-08T00:00:00', '2026-01-01T00:00:00'))
+    conn.execute(yumi_maintenance.EVENT_INSERT,
+                 yumi_maintenance.event_row('clean_plate', 'confirmed', {'print_seconds': 3600.}))
+    conn.execute("DELETE FROM maintenance_history WHERE name='clean_plate'")
+    conn.commit()
+    conn.close()
+
+    feed = changes(path)
+    assert [(table, op, key) for _, table, op, key, _ in feed] == [
+        ('history', 'upsert', 'clean_plate'), ('history', 'upsert', 'clean_plate'),
+        ('events', 'insert', '1'), ('history', 'delete', 'clean_plate')]
+    assert [seq for seq, *_ in feed] == sorted(seq for seq, *_ in feed)
+    assert feed[1][4]['next_check'] == '2026-01-08T00:00:00'
+    assert json.loads(feed[2][4]['usage']) == {'print_seconds': 3600.0}
+    assert changes(path, feed[1][0]) == feed[2:]
+
+
+def test_collector_merges_printers_from_their_cursor(tmp_path):
+    sources = []
+    for printer, names in (('p1', ('clean_plate', 'clean_nozzle')), ('p2', ('clean_plate',))):
+        path = str(tmp_path / printer / "yumi_maintenance.db")
+        (tmp_path / printer).mkdir()
+        conn = printer_db(path)
+        conn.executemany(yumi_maintenance.HISTORY_UPSERT, [history(n, '2026-02-01T00:00:00') for n in names])
+        conn.commit()
+        conn.close()
+        sources.append(path)
+    store = maintenance_collector.open_store(str(tmp_path / "fleet.db"))
+
+    assert [maintenance_collector.collect(store, s) for s in sources] == [('p1', 2), ('p2', 1)]
+    assert store.execute("SELECT printer, name FROM tasks ORDER BY printer, name").fetchall() == [
+        ('p1', 'clean_nozzle'), ('p1', 'clean_plate'), ('p2', 'clean_plate')]
+    # Nothing new: the stored cursors skip what was collected
+    assert maintenance_collector.collect(store, sources[0]) == ('p1', 0)
+
+    conn = sqlite3.connect(sources[0])
+    conn.execute(yumi_maintenance.HISTORY_UPSERT,
+                 history('clean_plate', '2026-03-01T00:00:00', '2026-02-01T00:00:00'))
+    conn.execute(yumi_maintenance.EVENT_INSERT,
+                 yumi_maintenance.event_row('clean_plate', 'confirmed', {}))
+    conn.execute("DELETE FROM maintenance_history WHERE name='clean_nozzle'")
+    conn.commit()
+    conn.close()
+    assert maintenance_collector.collect(store, sources[0]) == ('p1', 3)
+    assert store.execute("SELECT printer, name, next_check FROM tasks ORDER BY printer").fetchall() == [
+        ('p1', 'clean_plate', '2026-03-01T00:00:00'), ('p2', 'clean_plate', '2026-02-01T00:00:00')]
+    assert store.execute("SELECT printer, task, action FROM events").fetchall() == [
+        ('p1', 'clean_plate', 'confirmed')]
+    assert maintenance_collector.get_cursor(store, 'p1') == len(changes(sources[0]))
+
+
+def test_jsonl_feed_merges_like_the_database(tmp_path):
+    path = str(tmp_path / "yumi_maintenance.db")
+    conn = printer_db(path)
+    conn.execute(yumi_maintenance.HISTORY_UPSERT, history('clean_plate', '2026-02-01T00:00:00'))
+    conn.commit()
+    conn.close()
+    feed = tmp_path / "delta.jsonl"
+    conn = maintenance_feed.connect(path)
+    with open(feed, "w") as out:
+        assert maintenance_feed.export(conn, out) == 1
+    conn.close()
+    store = maintenance_collector.open_store(str(tmp_path / "fleet.db"))
+    assert maintenance_collector.collect(store, f"p9={feed}") == ('p9', 1)
+    assert store.execute("SELECT printer, name FROM tasks").fetchall() == [('p9', 'clean_plate')]
+
+
+def test_source_id_of_printer_data_layout():
+    assert maintenance_collector.source_id("/mnt/p12/printer_data/database/yumi_maintenance.db") == \
+        "p12/printer_data"
+    assert maintenance_collector.source_id("/mnt/p12/printer_2_data/database/yumi_maintenance.db") == \
+        "p12/printer_2_data"
+    assert maintenance_collector.source_id("/mnt/printers/p12/yumi_maintenance.db") == "p12"
+    assert maintenance_collector.source_id("/tmp/p3.jsonl") == "p3"
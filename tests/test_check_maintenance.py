@@ -0,0 +1,109 @@
+"""rewrite_printer_cfg and reconcile of check_maintenance.py on temporary files"""
+import os
+
+import check_maintenance
+
+BASE = """[save_variables]
+filename: ~/printer_data/config/variables.cfg
+
+[printer]
+kinematics: corexy
+#*# <---------------------- SAVE_CONFIG ---------------------->
+#*# [bed_mesh default]
+"""
+
+CONFIGURED = """[save_variables]
+filename: ~/printer_data/config/variables.cfg
+[yumi_maintenance]
+batch_prompts: False
+coalesce_prompts: True
+
+[yumi_maintenance_task clean_plate]
+interval_days: 7
+# weekly
+message: Clean Plate
+
+[printer]
+kinematics: corexy
+#*# <---------------------- SAVE_CONFIG ---------------------->
+#*# [bed_mesh default]
+"""
+
+
+def write(tmp_path, text, name="printer.cfg"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def active_sections(text):
+    return [line for line in text.splitlines() if line.startswith("[")]
+
+
+def test_marker_added_after_save_variables_and_removed(tmp_path):
+    path = write(tmp_path, BASE)
+    assert check_maintenance.rewrite_printer_cfg(True, path) == (True, True)
+    text = open(path).read()
+    assert "variables.cfg\n[yumi_maintenance]\n\n[printer]" in text
+    assert check_maintenance.rewrite_printer_cfg(True, path) == (False, True)
+
+    assert check_maintenance.rewrite_printer_cfg(False, path) == (True, False)
+    assert active_sections(open(path).read()) == ["[save_variables]", "[printer]"]
+    assert check_maintenance.rewrite_printer_cfg(False, path) == (False, False)
+
+
+def test_disable_comments_out_options_and_task_sections(tmp_path):
+    path = write(tmp_path, CONFIGURED)
+    assert check_maintenance.rewrite_printer_cfg(False, path) == (True, False)
+    text = open(path).read()
+    # No option may end up under [save_variables], Klipper would reject it
+    save_variables = text.split("[printer]")[0]
+    assert [line for line in save_variables.splitlines()
+            if line and not line.startswith(("[", "#"))] == ["filename: ~/printer_data/config/variables.cfg"]
+    assert "#~ batch_prompts: False" in text and "#~ [yumi_maintenance_task clean_plate]" in text
+    assert active_sections(text) == ["[save_variables]", "[printer]"]
+    assert text.endswith("#*# [bed_mesh default]\n")
+
+
+def test_enable_restores_the_disabled_sections(tmp_path):
+    path = write(tmp_path, CONFIGURED)
+    check_maintenance.rewrite_printer_cfg(False, path)
+    assert check_maintenance.rewrite_printer_cfg(True, path) == (True, True)
+    assert open(path).read() == CONFIGURED
+
+
+def test_task_sections_need_a_place_for_the_marker(tmp_path):
+    text = "[printer]\n#~ [yumi_maintenance_task clean_plate]\n#~ interval_days: 7\n"
+    path = write(tmp_path, text)
+    assert check_maintenance.rewrite_printer_cfg(True, path) == (False, False)
+    assert open(path).read() == text
+
+
+def test_symlinked_printer_cfg_keeps_its_link(tmp_path):
+    (tmp_path / "real").mkdir()
+    target = write(tmp_path, BASE, os.path.join("real", "printer.cfg"))
+    link = tmp_path / "printer.cfg"
+    link.symlink_to(target)
+    assert check_maintenance.rewrite_printer_cfg(True, str(link)) == (True, True)
+    assert link.is_symlink()
+    assert "[yumi_maintenance]" in open(target).read()
+
+
+def test_reconcile_follows_the_enable_flag(tmp_path):
+    path = write(tmp_path, BASE)
+    stamps = {}
+    assert check_maintenance.reconcile(True, stamps, path)
+    assert stamps[path]["has_marker"]
+    assert not check_maintenance.reconcile(True, stamps, path)
+    assert check_maintenance.reconcile(False, stamps, path)
+    assert active_sections(open(path).read()) == ["[save_variables]", "[printer]"]
+
+
+def test_check_reads_the_flag_of_each_instance(tmp_path):
+    config = tmp_path / "printer_data" / "config"
+    config.mkdir(parents=True)
+    write(config, BASE)
+    write(config, "enable_maintenance=True\n", "Yumi_Maintenance.cfg")
+    instance = check_maintenance.instance_paths(str(config))
+    assert check_maintenance.check(instance) == (True, True)
+    assert check_maintenance.check(instance) == (True, False)
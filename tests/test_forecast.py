@@ -0,0 +1,57 @@
+"""project_due and forecast, with and without numpy"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import yumi_maintenance
+from yumi_maintenance import MaintenanceTask, forecast, project_due, usage_rates
+
+
+def random_rows(count, triggers, seed):
+    rng = random.Random(seed)
+    # Whole seconds keep both paths exact, so ties order the same way
+    first = [[rng.randint(-86400, 120 * 86400) for _ in range(triggers)] for _ in range(count)]
+    period = [[rng.randint(3600, 60 * 86400) for _ in range(triggers)] for _ in range(count)]
+    return first, period
+
+
+@pytest.mark.skipif(yumi_maintenance.numpy is None, reason="numpy not installed")
+@pytest.mark.parametrize("count, triggers, seed", [(1, 1, 1), (6, 2, 2), (200, 5, 3)])
+def test_project_due_same_with_and_without_numpy(monkeypatch, count, triggers, seed):
+    first, period = random_rows(count, triggers, seed)
+    span = 90 * 86400.
+    with_numpy = project_due(first, period, span, max_per_task=50)
+    monkeypatch.setattr(yumi_maintenance, "numpy", None)
+    without = project_due(first, period, span, max_per_task=50)
+    assert with_numpy == without
+    assert with_numpy == sorted(with_numpy, key=lambda row: row[0])
+
+
+def test_project_due_repeats_and_caps():
+    rows = project_due([[-5., 100.]], [[10., 50.]], 35., max_per_task=3)
+    assert rows == [(0., 0, 0), (10., 0, 0), (20., 0, 0)]
+    assert project_due([[100.]], [[10.]], 35.) == []
+
+
+def test_forecast_takes_the_earliest_trigger():
+    now = datetime(2026, 1, 1)
+    task = MaintenanceTask.from_options('clean_plate', {
+        'interval_days': '30', 'interval_print_hours': '10', 'message': "Clean Plate",
+        'prompt': "Clean the plate"})
+    task.next_check = now + timedelta(days=30)
+    task.usage_baseline = {'print_seconds': 0.}
+    # 5 of 10 print hours used at one print hour per day: due by usage in 5 days, then every 10
+    due = forecast([task], now, {'print_seconds': 5 * 3600.}, {'print_seconds': 3600. / 86400.},
+                   timedelta(days=20))
+    assert [(when, t.name, trigger) for when, t, trigger in due] == [
+        (now + timedelta(days=5), 'clean_plate', 'print_hours'),
+        (now + timedelta(days=15), 'clean_plate', 'print_hours')]
+
+
+def test_usage_rates_need_an_hour_of_history():
+    now = datetime(2026, 1, 2)
+    snapshot = ((now - timedelta(days=1)).isoformat(), '{"print_seconds":0.0}')
+    assert usage_rates(snapshot, {'print_seconds': 8640.}, now) == {'print_seconds': .1}
+    assert usage_rates(((now - timedelta(minutes=5)).isoformat(), '{}'), {}, now) == {}
+    assert usage_rates(None, {}, now) == {}
@@ -0,0 +1,87 @@
+"""Prompt display, coalescing and deferral of YumiMaintenance on a fake printer"""
+import time
+
+
+def shown_titles(printer):
+    return [line for line in printer.gcode.responses if "prompt_begin" in line]
+
+
+def test_tasks_due_together_share_one_dialog(maintenance):
+    printer, instance = maintenance({'coalesce_prompts': True})
+    instance._tasks_due(['clean_nozzle', 'clean_plate', 'belt_tension'])
+    assert instance.active_prompts == {'clean_nozzle', 'clean_plate', 'belt_tension'}
+    assert len(shown_titles(printer)) == 1
+    assert not instance.prompt_queue
+
+
+def test_without_coalescing_tasks_are_shown_one_after_another(maintenance):
+    printer, instance = maintenance({'coalesce_prompts': False})
+    instance._tasks_due(['clean_nozzle', 'clean_plate'])
+    assert len(instance.active_prompts) == 1
+    assert len(instance.prompt_queue) == 1
+    first = next(iter(instance.active_prompts))
+    printer.gcode.run("MAINTENANCE_CONFIRM", TASK=first)
+    printer.reactor.run_pending()
+    assert instance.active_prompts == {'clean_nozzle', 'clean_plate'} - {first}
+    assert len(shown_titles(printer)) == 2
+
+
+def test_confirming_one_task_shows_the_rest_again(maintenance):
+    printer, instance = maintenance({'coalesce_prompts': True})
+    instance._tasks_due(['clean_nozzle', 'clean_plate'])
+    printer.gcode.run("MAINTENANCE_CONFIRM", TASK='clean_nozzle')
+    assert instance.tasks['clean_nozzle'].last_done is not None
+    printer.reactor.run_pending()
+    assert instance.active_prompts == {'clean_plate'}
+    assert instance.tasks['clean_plate'].last_done is None
+    assert len(shown_titles(printer)) == 2
+
+
+def test_postpone_reschedules_after_postpone_hours(maintenance):
+    printer, instance = maintenance({'postpone_hours': 2.})
+    instance._tasks_due(['clean_plate'])
+    printer.gcode.run("MAINTENANCE_POSTPONE", TASK='clean_plate')
+    printer.reactor.run_pending()
+    assert not instance.active_prompts
+    deadline = instance.scheduler.get_deadline('clean_plate')
+    assert 7100. < deadline - time.time() <= 7200.
+
+
+def test_prompts_are_deferred_while_printing_and_flushed_after(maintenance):
+    printer, instance = maintenance({'coalesce_prompts': True})
+    print_stats = printer.lookup_object('print_stats')
+    print_stats.state = "printing"
+    printer.send_event("idle_timeout:printing", 0.)
+    instance._tasks_due(['clean_nozzle'])
+    instance._tasks_due(['clean_plate'])
+    assert not instance.active_prompts
+    assert instance.pending_prompts == {'clean_nozzle', 'clean_plate'}
+    assert not shown_titles(printer)
+
+    # idle_timeout reports Ready between moves while the print is still running
+    printer.send_event("idle_timeout:ready", 0.)
+    assert instance.pending_prompts == {'clean_nozzle', 'clean_plate'}
+
+    print_stats.state = "complete"
+    printer.send_event("idle_timeout:ready", 0.)
+    assert instance.active_prompts == {'clean_nozzle', 'clean_plate'}
+    assert not instance.pending_prompts
+    assert len(shown_titles(printer)) == 1
+    assert instance.get_status(0.)['prompts_flushed'] == 2
+
+
+def test_defer_while_printing_can_be_disabled(maintenance):
+    printer, instance = maintenance({'defer_while_printing': False})
+    printer.lookup_object('print_stats').state = "printing"
+    printer.send_event("idle_timeout:printing", 0.)
+    instance._tasks_due(['clean_plate'])
+    assert instance.active_prompts == {'clean_plate'}
+
+
+def test_per_line_prompts_for_other_clients(maintenance):
+    printer, instance = maintenance({'batch_prompts': False})
+    instance._tasks_due(['clean_plate'])
+    actions = [line for line in printer.gcode.responses if line.startswith("// action:")]
+    assert not any("prompt_batch" in line for line in actions)
+    assert any("prompt_footer_button" in line for line in actions)
+    assert actions[-1] == "// action:prompt_show"
@@ -0,0 +1,88 @@
+import time
+from types import SimpleNamespace
+
+import fakes
+import yumi_maintenance
+from yumi_maintenance import DeadlineScheduler, PromptQueue
+
+
+def make_scheduler():
+    reactor = fakes.FakeReactor()
+    calls = []
+    scheduler = DeadlineScheduler(reactor, calls.append)
+    scheduler.start()
+    return reactor, scheduler, calls
+
+
+def test_due_deadlines_fire_together_in_deadline_order():
+    reactor, scheduler, calls = make_scheduler()
+    now = time.time()
+    scheduler.schedule('later', now + 3600.)
+    scheduler.schedule('second', now - 10.)
+    scheduler.schedule('first', now - 20.)
+    reactor.run_pending(reactor.monotonic() + 1.)
+    assert calls == [['first', 'second']]
+    assert scheduler.get_deadline('later') == now + 3600.
+    assert scheduler.get_deadline('first') is None
+
+
+def test_moved_and_removed_deadlines_do_not_fire():
+    reactor, scheduler, calls = make_scheduler()
+    now = time.time()
+    scheduler.schedule('moved', now - 10.)
+    scheduler.schedule('moved', now + 3600.)
+    scheduler.schedule('removed', now - 10.)
+    scheduler.remove('removed')
+    reactor.run_pending(reactor.monotonic() + 1.)
+    assert calls == []
+    assert scheduler.get_deadline('moved') == now + 3600.
+
+
+def test_timer_sleeps_until_the_earliest_deadline_capped_hourly():
+    reactor, scheduler, calls = make_scheduler()
+    assert reactor.timers[0][1] == reactor.NEVER
+    scheduler.schedule('soon', time.time() + 60.)
+    assert 50. < reactor.timers[0][1] - reactor.monotonic() <= 60.
+    scheduler.schedule('soon', time.time() + 10 * 86400.)
+    scheduler.remove('soon')
+    scheduler.schedule('far', time.time() + 10 * 86400.)
+    eventtime = reactor.monotonic()
+    assert scheduler._handle_timer(eventtime) == eventtime + DeadlineScheduler.MAX_SLEEP
+    assert calls == []
+
+
+def test_stale_heap_entries_are_compacted():
+    reactor, scheduler, calls = make_scheduler()
+    for i in range(200):
+        scheduler.schedule('task', time.time() + 3600. + i)
+    assert len(scheduler.heap) <= 2 * len(scheduler.deadlines) + 32
+
+
+def task(name, priority):
+    return SimpleNamespace(name=name, priority=priority)
+
+
+def test_prompt_queue_pops_by_priority_then_arrival():
+    queue = PromptQueue()
+    for name, priority in (('b', 2), ('a', 1), ('c', 2), ('d', 3)):
+        assert queue.push(task(name, priority))
+    assert [queue.pop().name for _ in range(4)] == ['a', 'b', 'c', 'd']
+    assert queue.pop() is None
+
+
+def test_prompt_queue_holds_each_task_once():
+    queue = PromptQueue()
+    assert queue.push(task('a', 1))
+    assert not queue.push(task('a', 1))
+    queue.push(task('b', 2))
+    assert len(queue) == 2 and 'a' in queue
+    assert [t.name for t in queue.pop_all()] == ['a', 'b']
+    assert not queue
+    queue.push(task('c', 1))
+    queue.clear()
+    assert queue.pop() is None
+
+
+def test_builtin_tasks_parse():
+    names = [name for name, _ in yumi_maintenance.parse_task_sections(yumi_maintenance.DEFAULT_TASKS)]
+    assert 'clean_nozzle' in names and len(names) == len(set(names))